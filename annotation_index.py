@@ -0,0 +1,184 @@
+import os
+import re
+import json
+from pathlib import Path
+import polars as pl
+
+# --- Configuration ---
+SPLITS = ['train', 'val', 'test']
+
+# The columnar index is cached next to the splits it describes, e.g. FinalDataset/annotations.parquet
+INDEX_FILENAME = 'annotations.parquet'
+# What the index was built from (per split: label file count, total size, newest file mtime, labels/ dir mtime)
+SIGNATURE_FILENAME = 'annotations.signature.json'
+
+# Stems to leave out of every selection: near-duplicate copies (image_dedup.py --exclude)
+# and images that fail to decode (image_integrity.py)
+EXCLUSIONS_FILENAME = 'dedup_exclusions.txt'
+CORRUPT_FILENAME = 'corrupt_images.txt'
+EXCLUSION_FILENAMES = [EXCLUSIONS_FILENAME, CORRUPT_FILENAME]
+
+# Merged stems look like 'dataset3_IMG_0042'; the prefix tells us which source dataset it came from
+SOURCE_PATTERN = re.compile(r'^(dataset\d+)_')
+
+SCHEMA = {
+    'stem': pl.Utf8,
+    'split': pl.Utf8,
+    'source': pl.Utf8,
+    'class_id': pl.Int32,
+    'x': pl.Float32,
+    'y': pl.Float32,
+    'w': pl.Float32,
+    'h': pl.Float32,
+}
+
+
+def source_of(stem):
+    """Returns the source dataset prefix of a merged stem (e.g. 'dataset1'), or None."""
+    match = SOURCE_PATTERN.match(stem)
+    return match.group(1) if match else None
+
+
+def parse_label_file(label_path):
+    """Parses a YOLO label file into a list of (class_id, x, y, w, h) tuples."""
+    rows = []
+    with open(label_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            try:
+                rows.append((int(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])))
+            except ValueError:
+                print(f"Error reading line in {Path(label_path).name}. Skipping: {line.strip()}")
+    return rows
+
+
+def scan_dataset(dataset_root, splits=SPLITS):
+    """Parses every label file of every split exactly once into a single columnar table."""
+    dataset_root = Path(dataset_root)
+    columns = {name: [] for name in SCHEMA}
+
+    for split in splits:
+        labels_dir = dataset_root / split / 'labels'
+        if not labels_dir.exists():
+            continue
+
+        with os.scandir(labels_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.txt'):
+                    continue
+
+                stem = entry.name[:-4]
+                source = source_of(stem)
+                for class_id, x, y, w, h in parse_label_file(entry.path):
+                    columns['stem'].append(stem)
+                    columns['split'].append(split)
+                    columns['source'].append(source)
+                    columns['class_id'].append(class_id)
+                    columns['x'].append(x)
+                    columns['y'].append(y)
+                    columns['w'].append(w)
+                    columns['h'].append(h)
+
+    return pl.DataFrame(columns, schema=SCHEMA)
+
+
+def label_signature(dataset_root, splits=SPLITS):
+    """
+    {split: [files, total bytes, newest file mtime, labels/ dir mtime]} of the label files. Edits in place
+    change a file's size/mtime without touching the directory; renames and deletions change the directory.
+    """
+    signature = {}
+    for split in splits:
+        labels_dir = Path(dataset_root) / split / 'labels'
+        if not labels_dir.exists():
+            continue
+        files = total_size = newest = 0
+        with os.scandir(labels_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.txt'):
+                    stat = entry.stat()
+                    files += 1
+                    total_size += stat.st_size
+                    newest = max(newest, stat.st_mtime_ns)
+        signature[split] = [files, total_size, newest, labels_dir.stat().st_mtime_ns]
+    return signature
+
+
+def _index_is_fresh(index_path, signature_path, signature):
+    """The cache is fresh if it was built from label files with exactly this signature."""
+    if not index_path.exists() or not signature_path.exists():
+        return False
+    with open(signature_path, 'r') as f:
+        return json.load(f) == signature
+
+
+def load_annotation_index(dataset_root, splits=SPLITS, rebuild=False):
+    """
+    Returns the annotation table for `dataset_root`, scanning the label files only
+    when the cached Parquet file is missing or the label files changed since it was built.
+    """
+    dataset_root = Path(dataset_root)
+    index_path = dataset_root / INDEX_FILENAME
+    signature_path = dataset_root / SIGNATURE_FILENAME
+    # Taken before scanning: a label edited during the scan makes the next load rebuild
+    signature = label_signature(dataset_root, SPLITS)
+
+    if not rebuild and _index_is_fresh(index_path, signature_path, signature):
+        index = pl.read_parquet(index_path)
+    else:
+        print(f"--- Building annotation index for: {dataset_root} ---")
+        index = scan_dataset(dataset_root, SPLITS)
+        if dataset_root.exists():
+            # Write through a temp file so a hardlinked copy of the dataset never shares the new index
+            tmp_path = index_path.with_name(INDEX_FILENAME + '.tmp')
+            index.write_parquet(tmp_path)
+            os.replace(tmp_path, index_path)
+            tmp_path = signature_path.with_name(SIGNATURE_FILENAME + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(signature, f)
+            os.replace(tmp_path, signature_path)
+            print(f"✅ Annotation index saved: {index_path} ({index.height} annotations)")
+
+    if list(splits) != SPLITS:
+        index = index.filter(pl.col('split').is_in(list(splits)))
+    return index
+
+
+def class_counts(index):
+    """Returns {class_id: annotation_count} for the given table."""
+    counts = index.group_by('class_id').len()
+    return dict(zip(counts['class_id'].to_list(), counts['len'].to_list()))
+
+
+def stems_by_class(index):
+    """Returns {class_id: [unique image stems containing that class]}."""
+    grouped = index.group_by('class_id').agg(pl.col('stem').unique())
+    return dict(zip(grouped['class_id'].to_list(), grouped['stem'].to_list()))
+
+
+def load_exclusions(dataset_root):
+    """Returns the stems listed in dataset_root's exclusion files (empty set if there are none)."""
+    excluded = set()
+    for filename in EXCLUSION_FILENAMES:
+        path = Path(dataset_root) / filename
+        if path.exists():
+            with open(path, 'r') as f:
+                excluded.update(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return excluded
+
+
+def drop_stems(index, stems):
+    """Returns the table without the annotations of the given image stems."""
+    if not stems:
+        return index
+    return index.filter(~pl.col('stem').is_in(list(stems)))
+
+
+if __name__ == "__main__":
+    import sys
+
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else Path('FinalDataset')
+    table = load_annotation_index(root, rebuild=True)
+    print(table.group_by('split').agg(pl.len().alias('annotations'), pl.col('stem').n_unique().alias('images')))
@@ -1,9 +1,12 @@
 import os
 from pathlib import Path
 import random
+from class_lookup import load_class_lookup
 # --- Configuration ---
-# Point this to the LABELS folder of your NEW merged dataset
-FINAL_LABEL_DIR = Path('./foodseg103_low_samples_only/train/labels')
+# Point this to your NEW merged dataset and the split to verify
+FINAL_DATASET_ROOT = Path('./foodseg103_low_samples_only')
+SPLIT = 'train'
+SAMPLES_PER_CLASS = 5
 
 # Classes to check (select a few easy ones and the problematic ones)
 CLASSES_TO_CHECK = [
@@ -18,26 +21,13 @@ CLASSES_TO_CHECK = [
 random.seed(42)
 print("--- Starting Final Label Verification ---")
 
+# Load the persistent class lookup (only label files changed since the last run are re-parsed)
+lookup = load_class_lookup(FINAL_DATASET_ROOT, splits=[SPLIT])
+
 for class_id, class_name in CLASSES_TO_CHECK:
-    found_images = []
-    
-    # Iterate through all label files in the merged dataset
-    for label_file in FINAL_LABEL_DIR.glob('*.txt'):
-        with open(label_file, 'r') as f:
-            for line in f:
-                # Check if the line starts with the target class ID
-                if line.startswith(f"{class_id} "):
-                    # The image name stem is the label file name without '.txt'
-                    image_stem = label_file.stem 
-                    
-                    # The unique stem includes the original dataset name (e.g., dataset1_0001)
-                    # The script prints this unique stem for easy tracking
-                    found_images.append(image_stem)
-                    break # Move to next label file
-        
-        # Stop check after finding a reasonable sample size
-        if len(found_images) >= 5:
-            break
+    # The unique stem includes the original dataset name (e.g., dataset1_0001)
+    # Random samples spread over the source datasets instead of the first hits in directory order
+    found_images = lookup.sample(class_id, SAMPLES_PER_CLASS, split=SPLIT, stratify=True, seed=random.randrange(2**32))
 
     print(f"\n✅ Class {class_id} ({class_name}): Found {len(found_images)} samples.")
     if found_images:
@@ -0,0 +1,157 @@
+import os
+import json
+import random
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from annotation_index import SPLITS, source_of, parse_label_file
+
+# --- Configuration ---
+# The lookup is stored next to the splits it describes, e.g. FinalDataset/class_lookup.json
+LOOKUP_FILENAME = 'class_lookup.json'
+LOOKUP_VERSION = 1
+
+
+class ClassLookup:
+    """
+    Persistent class_id -> image stems lookup for a YOLO dataset.
+    Every label file is recorded with its mtime/size, so `update()` only re-parses files that changed.
+    """
+
+    def __init__(self, dataset_root, splits=SPLITS):
+        self.dataset_root = Path(dataset_root)
+        self.splits = list(splits)
+        self.path = self.dataset_root / LOOKUP_FILENAME
+        # {'train/dataset1_0001': {'mtime': ns, 'size': bytes, 'classes': [ids]}}
+        self.files = {}
+        self._class_to_keys = None
+
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            if stored.get('version') == LOOKUP_VERSION:
+                self.files = stored['files']
+
+    def update(self):
+        """Re-parses new or modified label files, drops deleted ones and saves. Returns (parsed, removed)."""
+        seen = set()
+        parsed = 0
+
+        for split in self.splits:
+            labels_dir = self.dataset_root / split / 'labels'
+            if not labels_dir.exists():
+                continue
+
+            with os.scandir(labels_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.txt'):
+                        continue
+
+                    key = f"{split}/{entry.name[:-4]}"
+                    seen.add(key)
+                    stat = entry.stat()
+                    record = self.files.get(key)
+                    if record and record['mtime'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                        continue
+
+                    classes = sorted({row[0] for row in parse_label_file(entry.path)})
+                    self.files[key] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'classes': classes}
+                    parsed += 1
+
+        removed = [key for key in self.files if key.split('/', 1)[0] in self.splits and key not in seen]
+        for key in removed:
+            del self.files[key]
+
+        if parsed or removed or not self.path.exists():
+            self.save()
+        self._class_to_keys = None
+        return parsed, len(removed)
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': LOOKUP_VERSION, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def class_to_keys(self):
+        """{class_id: ['split/stem', ...]} derived from the stored per-file records."""
+        if self._class_to_keys is None:
+            class_to_keys = defaultdict(list)
+            for key in sorted(self.files):
+                for class_id in self.files[key]['classes']:
+                    class_to_keys[class_id].append(key)
+            self._class_to_keys = dict(class_to_keys)
+        return self._class_to_keys
+
+    def stems(self, class_id, split=None, source=None):
+        """Returns every stem containing `class_id`, optionally restricted to one split and source prefix."""
+        stems = []
+        for key in self.class_to_keys.get(class_id, []):
+            key_split, stem = key.split('/', 1)
+            if split is not None and key_split != split:
+                continue
+            if source is not None and source_of(stem) != source:
+                continue
+            stems.append(stem)
+        return stems
+
+    def sample(self, class_id, n, split=None, source=None, stratify=False, seed=None):
+        """
+        Returns up to `n` random stems of `class_id`.
+        With stratify=True the picks are spread evenly over the source dataset prefixes (dataset1_..dataset6_).
+        """
+        rng = random.Random(seed)
+        stems = self.stems(class_id, split=split, source=source)
+        if not stratify:
+            return rng.sample(stems, min(n, len(stems)))
+
+        by_source = defaultdict(list)
+        for stem in stems:
+            by_source[source_of(stem)].append(stem)
+        for group in by_source.values():
+            rng.shuffle(group)
+
+        # Round-robin over the sources so small sources still get represented
+        picked = []
+        groups = [by_source[name] for name in sorted(by_source, key=str)]
+        while len(picked) < n and any(groups):
+            for group in groups:
+                if group and len(picked) < n:
+                    picked.append(group.pop())
+        return picked
+
+
+def load_class_lookup(dataset_root, splits=SPLITS):
+    """Loads the stored lookup for `dataset_root` and brings it up to date."""
+    lookup = ClassLookup(dataset_root, splits)
+    parsed, removed = lookup.update()
+    if parsed or removed:
+        print(f"--- Class lookup updated: {parsed} label files parsed, {removed} removed ---")
+    return lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query random samples of a class from the persistent class lookup.")
+    parser.add_argument('dataset_root', type=Path, help="Dataset folder containing train/val/test splits")
+    parser.add_argument('class_ids', type=int, nargs='+', help="Class IDs to sample")
+    parser.add_argument('-n', '--num', type=int, default=5, help="Samples per class")
+    parser.add_argument('--split', choices=SPLITS, help="Only sample from this split")
+    parser.add_argument('--source', help="Only sample from this source dataset prefix (e.g. dataset3)")
+    parser.add_argument('--stratify', action='store_true', help="Spread samples evenly across source datasets")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed for reproducible samples")
+    args = parser.parse_args()
+
+    lookup = load_class_lookup(args.dataset_root)
+
+    for class_id in args.class_ids:
+        total = len(lookup.stems(class_id, split=args.split, source=args.source))
+        samples = lookup.sample(class_id, args.num, split=args.split, source=args.source,
+                                stratify=args.stratify, seed=args.seed)
+        print(f"\nClass {class_id}: {total} images, showing {len(samples)}")
+        for stem in samples:
+            print(f"   {stem}")
+
+
+if __name__ == "__main__":
+    main()
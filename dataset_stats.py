@@ -0,0 +1,274 @@
+import os
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# --- Configuration ---
+SPLITS = ['train', 'val', 'test']
+FILES_PER_CHUNK = 2000  # Label files handed to one worker task
+
+# Candidate training/inference sizes and the smallest object side (in pixels) we expect YOLO to detect
+IMGSZ_CANDIDATES = [320, 480, 640, 800, 960, 1280]
+MIN_OBJECT_PX = 8
+MAX_TINY_FRACTION = 0.01  # Recommend the smallest imgsz where at most 1% of boxes are below MIN_OBJECT_PX
+
+OBJECTS_PER_IMAGE_BINS = [0, 1, 2, 3, 4, 5, 6, 11, 21, 51]  # Last bin is open-ended
+AREA_BINS = [0.0, 0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0]  # Normalized w*h
+ASPECT_BINS = [0.0, 0.25, 0.5, 0.8, 1.25, 2.0, 4.0]  # Normalized w/h, last bin is open-ended
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+
+# ====================================================================
+# 1. PARALLEL PARSING (Label files -> NumPy arrays)
+# ====================================================================
+
+def _parse_slow(data, strict=False):
+    """
+    Line-by-line fallback for files that are not a clean 5-column block (segments, blank lines, bad tokens).
+    strict=True counts every line that is not exactly 5 tokens as malformed instead of reading its first 5.
+    """
+    rows = []
+    malformed = 0
+    for line in data.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) < 5 or (strict and len(parts) != 5):
+            malformed += 1
+            continue
+        try:
+            rows.append([float(token) for token in parts[:5]])
+        except ValueError:
+            malformed += 1
+    return rows, malformed
+
+
+def parse_label_chunk(label_paths, strict=False):
+    """
+    Worker: parses a chunk of label files (strict: see _parse_slow).
+    Returns (labels[N, 5] float32, objects_per_file[n_files] int32, malformed_lines int).
+    """
+    fast_tokens = []
+    slow_rows = []
+    objects_per_file = np.zeros(len(label_paths), dtype=np.int32)
+    fast_file_rows = []  # (file position, row count) in fast_tokens order
+    malformed = 0
+
+    for i, path in enumerate(label_paths):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        tokens = data.split()
+        lines = [line for line in data.splitlines() if line.strip()]
+        n_lines = len(lines)
+
+        # Fast path: a clean block of 5 tokens per line is converted in one shot per chunk
+        # (the per-line check keeps rows run together on one line, or split across lines, out of it)
+        if len(tokens) == 5 * n_lines and all(len(line.split()) == 5 for line in lines):
+            fast_tokens.extend(tokens)
+            fast_file_rows.append((i, n_lines))
+            objects_per_file[i] = n_lines
+        else:
+            rows, bad = _parse_slow(data, strict)
+            slow_rows.append((i, rows))
+            objects_per_file[i] = len(rows)
+            malformed += bad
+
+    try:
+        fast = np.array(fast_tokens, dtype=np.float64).reshape(-1, 5)
+    except ValueError:
+        # A non-numeric token somewhere in the chunk; fall back to the per-line parser for all of it
+        return _parse_chunk_slow(label_paths, strict)
+
+    # Reassemble rows in file order so labels line up with objects_per_file
+    blocks = []
+    fast_offset = 0
+    slow_iter = iter(slow_rows)
+    next_slow = next(slow_iter, None)
+    for i, n_rows in fast_file_rows:
+        while next_slow is not None and next_slow[0] < i:
+            if next_slow[1]:
+                blocks.append(np.asarray(next_slow[1], dtype=np.float64))
+            next_slow = next(slow_iter, None)
+        blocks.append(fast[fast_offset:fast_offset + n_rows])
+        fast_offset += n_rows
+    while next_slow is not None:
+        if next_slow[1]:
+            blocks.append(np.asarray(next_slow[1], dtype=np.float64))
+        next_slow = next(slow_iter, None)
+
+    labels = np.concatenate(blocks).astype(np.float32) if blocks else np.zeros((0, 5), dtype=np.float32)
+    return labels, objects_per_file, malformed
+
+
+def _parse_chunk_slow(label_paths, strict=False):
+    rows = []
+    objects_per_file = np.zeros(len(label_paths), dtype=np.int32)
+    malformed = 0
+    for i, path in enumerate(label_paths):
+        with open(path, 'rb') as f:
+            file_rows, bad = _parse_slow(f.read(), strict)
+        rows.extend(file_rows)
+        objects_per_file[i] = len(file_rows)
+        malformed += bad
+    labels = np.asarray(rows, dtype=np.float32).reshape(-1, 5)
+    return labels, objects_per_file, malformed
+
+
+def list_label_files(labels_dir):
+    """Returns the sorted label file paths of one labels/ directory."""
+    labels_dir = Path(labels_dir)
+    if not labels_dir.exists():
+        return []
+    with os.scandir(labels_dir) as entries:
+        return sorted(entry.path for entry in entries if entry.name.endswith('.txt'))
+
+
+def load_split_arrays(labels_dir, workers=None, executor=None, strict=False):
+    """
+    Parses every label file of one split across a process pool (strict: see _parse_slow).
+    Returns (label_files, labels[N, 5], file_index[N], objects_per_file[n_files], malformed_lines).
+    """
+    label_files = list_label_files(labels_dir)
+    chunks = [label_files[i:i + FILES_PER_CHUNK] for i in range(0, len(label_files), FILES_PER_CHUNK)]
+
+    parse_chunk = partial(parse_label_chunk, strict=strict)
+    if executor is not None:
+        results = list(executor.map(parse_chunk, chunks))
+    elif len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parse_chunk, chunks))
+    else:
+        results = [parse_chunk(chunk) for chunk in chunks]
+
+    if not results:
+        empty = np.zeros(0, dtype=np.int32)
+        return label_files, np.zeros((0, 5), dtype=np.float32), empty, empty, 0
+
+    labels = np.concatenate([r[0] for r in results])
+    objects_per_file = np.concatenate([r[1] for r in results])
+    malformed = sum(r[2] for r in results)
+    file_index = np.repeat(np.arange(len(label_files), dtype=np.int32), objects_per_file)
+    return label_files, labels, file_index, objects_per_file, malformed
+
+
+# ====================================================================
+# 2. VECTORIZED STATISTICS
+# ====================================================================
+
+def recommend_imgsz(labels):
+    """Returns (recommended imgsz, {imgsz: fraction of boxes whose short side is below MIN_OBJECT_PX})."""
+    # Normalized sides scale with the letterboxed long side, so this slightly overestimates the short axis
+    short_side = np.minimum(labels[:, 3], labels[:, 4])
+    tiny_fraction = {}
+    for imgsz in IMGSZ_CANDIDATES:
+        tiny_fraction[imgsz] = float(np.mean(short_side * imgsz < MIN_OBJECT_PX)) if len(labels) else 0.0
+
+    recommended = IMGSZ_CANDIDATES[-1]
+    for imgsz in IMGSZ_CANDIDATES:
+        if tiny_fraction[imgsz] <= MAX_TINY_FRACTION:
+            recommended = imgsz
+            break
+    return recommended, tiny_fraction
+
+
+def compute_split_stats(labels, file_index, objects_per_file, num_classes):
+    """Reduces one split's label arrays into per-class and per-image histograms."""
+    class_ids = labels[:, 0].astype(np.int64)
+    in_range = (class_ids >= 0) & (class_ids < num_classes)
+    valid = labels[in_range]
+    valid_ids = class_ids[in_range]
+    valid_files = file_index[in_range].astype(np.int64)
+
+    # Images per class: count each (image, class) pair once
+    pairs = np.unique(valid_files * num_classes + valid_ids)
+
+    w, h = valid[:, 3], valid[:, 4]
+    area = w * h
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect = np.where(h > 0, w / h, np.inf)
+
+    area_hist, _ = np.histogram(area, bins=AREA_BINS)
+    aspect_hist, _ = np.histogram(np.minimum(aspect, 1e9), bins=ASPECT_BINS + [np.inf])
+    objects_hist, _ = np.histogram(objects_per_file, bins=OBJECTS_PER_IMAGE_BINS + [np.iinfo(np.int32).max])
+    recommended_imgsz, tiny_fraction = recommend_imgsz(valid)
+
+    return {
+        'images': int(len(objects_per_file)),
+        'instances': int(len(valid)),
+        'out_of_range': int((~in_range).sum()),
+        'instances_per_class': np.bincount(valid_ids, minlength=num_classes),
+        'images_per_class': np.bincount(pairs % num_classes, minlength=num_classes),
+        'objects_per_image_hist': objects_hist,
+        'objects_per_image_mean': float(objects_per_file.mean()) if len(objects_per_file) else 0.0,
+        'objects_per_image_max': int(objects_per_file.max()) if len(objects_per_file) else 0,
+        'area_hist': area_hist,
+        'area_percentiles': np.percentile(area, PERCENTILES) if len(area) else np.zeros(len(PERCENTILES)),
+        'aspect_hist': aspect_hist,
+        'aspect_percentiles': np.percentile(aspect[np.isfinite(aspect)], PERCENTILES) if np.isfinite(aspect).any() else np.zeros(len(PERCENTILES)),
+        'tiny_fraction': tiny_fraction,
+        'recommended_imgsz': recommended_imgsz,
+    }
+
+
+def collect_dataset_stats(dataset_root, num_classes, splits=SPLITS, workers=None):
+    """
+    Computes stats for every split of `dataset_root` with one shared process pool.
+    Returns {split: stats} plus the label file list and out-of-range file names per split.
+    """
+    dataset_root = Path(dataset_root)
+    all_stats = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for split in splits:
+            labels_dir = dataset_root / split / 'labels'
+            if not labels_dir.exists():
+                continue
+            label_files, labels, file_index, objects_per_file, malformed = load_split_arrays(labels_dir, executor=pool)
+            stats = compute_split_stats(labels, file_index, objects_per_file, num_classes)
+            stats['malformed_lines'] = malformed
+
+            class_ids = labels[:, 0].astype(np.int64)
+            bad = (class_ids < 0) | (class_ids >= num_classes)
+            stats['out_of_range_files'] = [
+                (Path(label_files[i]).name, int(class_id)) for i, class_id in zip(file_index[bad], class_ids[bad])
+            ]
+            all_stats[split] = stats
+    return all_stats
+
+
+# ====================================================================
+# 3. REPORT
+# ====================================================================
+
+def _format_bins(bins, counts, open_ended, integer=False):
+    labels = []
+    for i, count in enumerate(counts):
+        low = bins[i]
+        if i == len(counts) - 1 and open_ended:
+            labels.append(f"{low}+: {count}")
+        elif integer:
+            high = bins[i + 1] - 1
+            labels.append(f"{low}: {count}" if high == low else f"{low}-{high}: {count}")
+        else:
+            labels.append(f"{low}-{bins[i + 1]}: {count}")
+    return ', '.join(labels)
+
+
+def print_distribution_report(split, stats):
+    """Prints the image/object/box distributions for one split."""
+    print(f"\n--- {split.upper()} distributions ---")
+    print(f"Images: {stats['images']}  Instances: {stats['instances']}  "
+          f"Out-of-range: {stats['out_of_range']}  Malformed lines: {stats['malformed_lines']}")
+    print(f"Objects per image: mean {stats['objects_per_image_mean']:.2f}, max {stats['objects_per_image_max']}")
+    print(f"   {_format_bins(OBJECTS_PER_IMAGE_BINS, stats['objects_per_image_hist'], open_ended=True, integer=True)}")
+    print("Box area (normalized w*h): "
+          + ', '.join(f"p{p}={v:.4f}" for p, v in zip(PERCENTILES, stats['area_percentiles'])))
+    print(f"   {_format_bins(AREA_BINS, stats['area_hist'], open_ended=False)}")
+    print("Aspect ratio (w/h): "
+          + ', '.join(f"p{p}={v:.2f}" for p, v in zip(PERCENTILES, stats['aspect_percentiles'])))
+    print(f"   {_format_bins(ASPECT_BINS, stats['aspect_hist'], open_ended=True)}")
+    print(f"Boxes with short side < {MIN_OBJECT_PX}px: "
+          + ', '.join(f"imgsz {size}: {frac:.1%}" for size, frac in stats['tiny_fraction'].items()))
+    print(f"💡 Recommended imgsz: {stats['recommended_imgsz']} "
+          f"(smallest size with <= {MAX_TINY_FRACTION:.0%} boxes under {MIN_OBJECT_PX}px)")
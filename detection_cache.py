@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from functools import lru_cache
+from model_backends import exported_path
+
+# --- Configuration ---
+# Detection results keyed on (image content, model fingerprint, predict parameters): a re-uploaded photo is
+# answered from memory or disk instead of running the model again
+CACHE_DIR = Path('.detection_cache')
+MEMORY_ITEMS = 1024  # In-process LRU tier
+MAX_DISK_BYTES = 256 * 1024 * 1024  # On-disk tier; least recently used entries are evicted beyond this
+EVICT_TO_FRACTION = 0.9  # Evict down to 90% of the limit, so eviction does not run on every write
+# Predict arguments that do not change the detections (everything else, e.g. conf/iou/imgsz, is part of the key)
+IGNORED_PREDICT_ARGS = ('verbose', 'stream', 'save', 'show')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_digest(data):
+    """Hash of the raw image bytes (the same photo uploaded twice gives the same digest)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def model_fingerprint(model_path, backend):
+    """
+    sha256 of best.pt plus the backend (and the export's mtime). Computed once per process, like load_model():
+    a retrained best.pt gives new keys, so results of the old model are never returned for it.
+    """
+    sha = hashlib.sha256(backend.encode())
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    export = exported_path(model_path, backend)
+    if backend != 'pytorch' and export.exists():
+        sha.update(str(export.stat().st_mtime_ns).encode())
+    return sha.hexdigest()
+
+
+def cache_key(digest, fingerprint, predict_args):
+    params = {key: value for key, value in predict_args.items() if key not in IGNORED_PREDICT_ARGS}
+    payload = json.dumps([digest, fingerprint, params], sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class DetectionCache:
+    """
+    Two-tier key -> detection record cache (records are JSON-serializable dicts, e.g. detector.result_record()).
+    Memory: OrderedDict LRU of MEMORY_ITEMS. Disk: one JSON file per key under CACHE_DIR, bounded to
+    MAX_DISK_BYTES by evicting the least recently used files (hits refresh a file's mtime).
+    Thread-safe, so the inference server's request threads can share one instance.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_items=MEMORY_ITEMS, max_disk_bytes=MAX_DISK_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evicted_files': 0}
+        self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _disk_entries(self):
+        """[(mtime, path, size)] of every cached file."""
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        with os.scandir(self.cache_dir) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if entry.name.endswith('.json'):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return entries
+
+    def _remember(self, key, record):
+        with self._lock:
+            self._memory[key] = record
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """The cached record, or None."""
+        with self._lock:
+            record = self._memory.get(key)
+            if record is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return record
+
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+            os.utime(path)  # Recently used: evicted last
+        except (OSError, ValueError):  # Missing, evicted by another process meanwhile, or half-written
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+
+        self._remember(key, record)
+        with self._lock:
+            self.stats['disk_hits'] += 1
+        return record
+
+    def put(self, key, record):
+        self._remember(key, record)
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(record).encode()
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += len(data)
+            over_limit = self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used files until the disk tier is under EVICT_TO_FRACTION of its limit."""
+        entries = sorted(self._disk_entries())  # Rescanned: other processes may share the directory
+        total = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * EVICT_TO_FRACTION
+        evicted = 0
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.stats['evicted_files'] += evicted
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'memory_items': len(self._memory), 'disk_bytes': self._disk_bytes}
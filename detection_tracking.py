@@ -1,9 +1,15 @@
+import argparse
 import collections
-from ultralytics import YOLO
+from model_backends import BACKENDS, DEFAULT_BACKEND, load_backend_model
 
 # --- SETUP ---
 CUSTOM_MODEL_PATH = 'raw_food_ingredients_GPU/raw_food_ingredients_detector_GPU3/weights/best.pt'
-model = YOLO(CUSTOM_MODEL_PATH)
+BACKEND = DEFAULT_BACKEND  # 'pytorch', 'onnx' or 'openvino' (or pass --backend)
+
+parser = argparse.ArgumentParser(description="Count unique ingredients in a video with tracking.")
+parser.add_argument('--backend', choices=BACKENDS, default=BACKEND)
+args = parser.parse_args()
+model = load_backend_model(CUSTOM_MODEL_PATH, args.backend)
 video_source = 'ingredients.mp4'  # Assuming your video file is here
 
 # To store all unique instances: {('Apple', 1), ('Cabbage', 2), ('Apple', 5)}
@@ -1,58 +1,242 @@
+import sys
+import glob
+import json
+import argparse
 import collections
-from ultralytics import YOLO
+import itertools
+from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from file_catalog import IMAGE_EXTENSIONS
+from model_backends import BACKENDS, DEFAULT_BACKEND, load_backend_model
+from detection_cache import DetectionCache, cache_key, content_digest, model_fingerprint
+from tiled_inference import TILE_OVERLAP, MAX_TILES, INCLUDE_FULL_IMAGE, NMS_IOU, predict_tiled
 
 # --- MODEL PATH CHANGE ---
-# 1. Load the Custom Trained Model
+# 1. The Custom Trained Model (loaded on first use, so importing this file stays cheap)
 CUSTOM_MODEL_PATH = 'raw_food_ingredients_GPU/raw_food_ingredients_detector_GPU3/weights/best.pt'
-model = YOLO(CUSTOM_MODEL_PATH)
+# 'pytorch' (best.pt), or 'onnx' / 'openvino' for the faster CPU runtimes (exported next to best.pt on first use)
+BACKEND = DEFAULT_BACKEND
 # -------------------------
 
 # 2. Define the Input Source
 image_source = 'eggs3.jpg'  # Change this to your image path or use 0 for webcam
 
-# 3. Run Prediction (Inference)
-# Pass save=False to disable saving the image to the 'runs/' folder.
-# We also set verbose=False to minimize command line clutter.
-results = model.predict(source=image_source, save=True, verbose=False)
-
-# 4. Process and Extract UNIQUE Names
-#detected_names = set() # Use a set to automatically store only unique names
-
-# Store ALL detected names in this list (including duplicates)
-all_detections = [] 
-
-for r in results:
-    # r.boxes.cls contains the class ID (e.g., 42) for every detected object
-    # r.names is a dictionary mapping the ID to the name (e.g., 42: 'bottle')
-
-    # Iterate through all detected class IDs in the image
-    for class_id in r.boxes.cls:
-        # Get the name using the ID and add it to the set
-        name = r.names[int(class_id)]
-        all_detections.append(name)
-
-# 5. Output Final List
-# Convert the set to a list for a final, clean output
-#final_list = sorted(list(detected_names))
-
-# 5. Tally and Output Final Count
-# Use Counter to count the occurrences of each name
-item_counts = collections.Counter(all_detections)
-
-# Format the output as a list of strings: ["3 Apple", "1 Broccoli", "2 Tomato"]
-final_output = [f"{count} {item}" for item, count in item_counts.items()]
-final_output_sorted = sorted(final_output)
-
-# print("--- Prediction Results ---")
-# print(f"Image Source: {image_source}")
-# print(f"Total Unique Objects Detected: {len(final_list)}")
-# print("List of Unique Detected Items:", final_list)
-# print("--------------------------")
-
-print("--- Prediction Results ---")
-print(f"Image Source: {image_source}")
-# The total count is simply the length of the list of ALL detections
-print(f"Total Objects Detected: {len(all_detections)}") 
-print(f"Total Unique Classes Detected: {len(item_counts)}") 
-print("List of Detected Items with Counts:", final_output_sorted)
-print("--------------------------")
\ No newline at end of file
+# Batch mode (python detector.py <dirs/globs/files> --out detections.jsonl)
+BATCH_SIZE = 16  # Images per predict() call
+DECODE_WORKERS = 8  # Threads decoding the next batches while the model runs on the current one
+PREFETCH_BATCHES = 2  # Decoded batches kept ready ahead of the model (bounds memory)
+DEFAULT_OUTPUT = 'detections.jsonl'
+USE_CACHE = True  # Reuse the detections of images already seen by this model (see detection_cache.py)
+# Sliced inference for 3000-4000 px phone photos (see tiled_inference.py): overlapping imgsz tiles instead of one
+# downscale, so small items survive. Costs up to MAX_TILES + 1 forward passes per image.
+TILED = False
+
+
+@lru_cache(maxsize=None)
+def load_model(model_path=CUSTOM_MODEL_PATH, backend=BACKEND):
+    """Loads the model once per process; inference_server.py keeps it loaded between requests."""
+    return load_backend_model(model_path, backend)
+
+
+def summarize_results(results):
+    """
+    Tallies the detections of one or more Results objects.
+    Returns (all_detections, item_counts, final_output_sorted), e.g. final_output_sorted = ["1 Broccoli", "3 Apple"].
+    """
+    # Store ALL detected names in this list (including duplicates)
+    all_detections = []
+
+    for r in results:
+        # r.boxes.cls contains the class ID (e.g., 42) for every detected object
+        # r.names is a dictionary mapping the ID to the name (e.g., 42: 'bottle')
+
+        # Iterate through all detected class IDs in the image
+        for class_id in r.boxes.cls:
+            # Get the name using the ID and add it to the list
+            name = r.names[int(class_id)]
+            all_detections.append(name)
+
+    # Use Counter to count the occurrences of each name
+    item_counts = collections.Counter(all_detections)
+
+    # Format the output as a list of strings: ["3 Apple", "1 Broccoli", "2 Tomato"]
+    final_output = [f"{count} {item}" for item, count in item_counts.items()]
+    final_output_sorted = sorted(final_output)
+    return all_detections, item_counts, final_output_sorted
+
+
+def print_summary(image_source, all_detections, item_counts, final_output_sorted):
+    print("--- Prediction Results ---")
+    print(f"Image Source: {image_source}")
+    # The total count is simply the length of the list of ALL detections
+    print(f"Total Objects Detected: {len(all_detections)}")
+    print(f"Total Unique Classes Detected: {len(item_counts)}")
+    print("List of Detected Items with Counts:", final_output_sorted)
+    print("--------------------------")
+
+
+# ====================================================================
+# BATCH MODE (directories, globs and file lists -> JSONL)
+# ====================================================================
+
+def iter_image_paths(sources):
+    """Expands directories, glob patterns, .txt file lists and plain paths into image paths (in order)."""
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+        elif path.suffix.lower() == '.txt':
+            with open(path, 'r') as f:
+                yield from (Path(line.strip()) for line in f if line.strip())
+        elif glob.has_magic(source):
+            yield from sorted(Path(p) for p in glob.glob(source, recursive=True)
+                              if Path(p).suffix.lower() in IMAGE_EXTENSIONS)
+        else:
+            yield path
+
+
+def prefetch_batches(paths, load=cv2.imread, batch_size=BATCH_SIZE, workers=DECODE_WORKERS, prefetch=PREFETCH_BATCHES):
+    """
+    Yields lists of (path, load(path)) of up to batch_size, loaded on a thread pool
+    (cv2 releases the GIL) while the caller runs the model. At most `prefetch` batches are loaded ahead.
+    """
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+
+        def queue_batch():
+            batch = [(path, pool.submit(load, path)) for path in itertools.islice(paths, batch_size)]
+            if batch:
+                pending.append(batch)
+
+        for _ in range(prefetch + 1):
+            queue_batch()
+        while pending:
+            batch = pending.popleft()
+            queue_batch()
+            yield [(path, future.result()) for path, future in batch]
+
+
+def cached_loader(cache, fingerprint, predict_args):
+    """
+    Loader for prefetch_batches(): reads the file once, hashes the bytes and only decodes on a cache miss.
+    Returns (cache key, cached record or None, BGR image or None). Without a cache the key is None.
+    """
+    def load(path):
+        try:
+            data = Path(path).read_bytes()
+        except OSError:
+            return None, None, None
+        if not data:
+            return None, None, None  # cv2.imdecode asserts on an empty buffer
+        key = cache_key(content_digest(data), fingerprint, predict_args) if cache else None
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            return key, cached, None
+        return key, None, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return load
+
+
+def result_record(path, result):
+    """One JSONL record: the ingredient counts plus every box (xyxy pixels) with its confidence."""
+    boxes = result.boxes
+    class_ids = boxes.cls.int().tolist()
+    names = [result.names[class_id] for class_id in class_ids]
+    return {
+        'image': str(path),
+        'total_objects': len(class_ids),
+        'counts': dict(sorted(collections.Counter(names).items())),
+        'detections': [
+            {'name': name, 'class_id': class_id, 'conf': round(conf, 4), 'box': [round(v, 1) for v in box]}
+            for name, class_id, conf, box in zip(names, class_ids, boxes.conf.tolist(), boxes.xyxy.tolist())
+        ],
+    }
+
+
+def detect_batch(sources, output_path=DEFAULT_OUTPUT, model_path=CUSTOM_MODEL_PATH, batch_size=BATCH_SIZE,
+                 backend=BACKEND, use_cache=USE_CACHE, tiled=TILED, **predict_args):
+    """
+    Runs the detector over every image of `sources` in fixed-size batches and streams one JSON line per image
+    to output_path. Nothing is accumulated, so memory stays flat however many images there are.
+    Images whose content was already detected with the same model and parameters come from the cache.
+    With tiled=True each image runs as one batch of overlapping tiles (see tiled_inference.py).
+    Returns (images processed, images that could not be read).
+    """
+    model = load_model(model_path, backend)
+    cache = DetectionCache() if use_cache else None
+    # Tiling changes the detections, so its settings are part of the cache key
+    key_args = {**predict_args, 'tiled': [TILE_OVERLAP, MAX_TILES, INCLUDE_FULL_IMAGE, NMS_IOU]} if tiled else predict_args
+    load = cached_loader(cache, model_fingerprint(model_path, backend) if cache else None, key_args)
+    processed = unreadable = 0
+    with open(output_path, 'w') as out:
+        for batch in prefetch_batches(iter_image_paths(sources), load, batch_size):
+            records = [None] * len(batch)  # Written in input order once the batch is complete
+            to_detect = []
+            for i, (path, (key, cached, image)) in enumerate(batch):
+                if cached is not None:
+                    records[i] = {'image': str(path), **cached}
+                elif image is None:
+                    records[i] = {'image': str(path), 'error': 'could not read image'}
+                    unreadable += 1
+                else:
+                    to_detect.append((i, path, key, image))
+
+            if to_detect:
+                if tiled:
+                    results = (predict_tiled(model, image, path=path, **predict_args) for _, path, _, image in to_detect)
+                else:
+                    results = model.predict([image for *_, image in to_detect], stream=True, verbose=False,
+                                            **predict_args)
+                for (i, path, key, _), result in zip(to_detect, results):
+                    records[i] = result_record(path, result)
+                    if cache:
+                        cache.put(key, {field: value for field, value in records[i].items() if field != 'image'})
+            for record in records:
+                out.write(json.dumps(record) + '\n')
+            processed += sum(1 for record in records if 'error' not in record)
+            out.flush()
+            print(f"\rProcessed {processed} images ({unreadable} unreadable)", end='', file=sys.stderr)
+    print(file=sys.stderr)
+    if cache:
+        stats = cache.snapshot()
+        print(f"Cache: {stats['memory_hits'] + stats['disk_hits']} hits, {stats['misses']} misses", file=sys.stderr)
+    return processed, unreadable
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect ingredients in one image, or in batches over many images.")
+    parser.add_argument('sources', nargs='*', help="Directories, glob patterns, .txt file lists or image paths")
+    parser.add_argument('--out', default=DEFAULT_OUTPUT, help="JSONL output for batch mode")
+    parser.add_argument('--model', default=CUSTOM_MODEL_PATH)
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND)
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--no-cache', action='store_true', help="Run the model on every image, even if seen before")
+    parser.add_argument('--tiled', action='store_true', default=TILED,
+                        help="Sliced inference: overlapping imgsz tiles for small objects in large photos")
+    args = parser.parse_args()
+
+    if not args.sources:
+        # 3. Run Prediction (Inference)
+        # Pass save=False to disable saving the image to the 'runs/' folder.
+        # We also set verbose=False to minimize command line clutter.
+        model = load_model(args.model, args.backend)
+        if args.tiled:
+            results = [predict_tiled(model, cv2.imread(image_source), imgsz=args.imgsz, path=image_source)]
+        else:
+            results = model.predict(source=image_source, save=True, verbose=False)
+
+        # 4. Tally and Output Final Count
+        print_summary(image_source, *summarize_results(results))
+        return
+
+    processed, unreadable = detect_batch(args.sources, args.out, args.model, args.batch, args.backend,
+                                      use_cache=not args.no_cache, tiled=args.tiled, imgsz=args.imgsz)
+    print(f"✅ {processed} images written to {args.out}" + (f" (⚠️ {unreadable} could not be read)" if unreadable else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import os
-import shutil
 import random
 from pathlib import Path
+from collections import defaultdict
 from tqdm import tqdm
-import sys
+from materialize import Materializer, write_text_if_changed
+from file_catalog import ImageCatalog
+from annotation_index import load_annotation_index, load_exclusions, drop_stems
+from taxonomy import load_taxonomy, remap
 
 # ====================================================================
 # 1. CONFIGURATION AND THRESHOLDS
@@ -22,54 +25,15 @@ DEST_ROOT = Path('./merged_final_data_balanced')
 
 SPLITS = ['train', 'val', 'test']
 
-# MASTER_NAMES (Full list of 140 classes for mapping)
-# NOTE: This list must be EXACTLY the same as in your previous merge script
-MASTER_NAMES = {
-    # Fruit, Nut, and Grains (0-29)
-    'almond': 0, 'apple': 1, 'apricot': 2, 'artichoke': 3, 'asparagus': 4,
-    'avocado': 5, 'bacon': 6, 'banana': 7, 'bean': 8, 'bean_curd_tofu': 9,
-    'bean_sprout': 10, 'beef': 11, 'beetroot': 12, 'bell_pepper': 13,
-    'black_pepper': 14, 'blackberry': 15, 'blueberry': 16, 'bok_choy': 17,
-    'bread': 18, 'brie_cheese': 19, 'broccoli': 20, 'brown_sugar': 21,
-    'brussels_sprouts': 22, 'butter': 23, 'buttermilk': 24, 'button_mushroom': 25,
-    'cabbage': 26, 'cantaloupe': 27, 'carrot': 28, 'cashew_nut': 29,
-    
-    # Vegetables and Herbs (30-59)
-    'cauliflower': 30, 'cayenne_pepper': 31, 'celery': 32, 'cheddar_cheese': 33,
-    'cheese': 34, 'cherry': 35, 'chicken': 36, 'chicken_breast': 37,
-    'chicken_stock': 38, 'chicken_wing': 39, 'chickpea': 40, 'chili': 41,
-    'chocolate': 42, 'cilantro': 43, 'cinnamon': 44, 'clementine': 45,
-    'coconut': 46, 'corn': 47, 'cucumber': 48, 'date': 49,
-    'dry_grape': 50, 'durian': 51, 'egg': 52, 'eggplant': 53,
-    'fig': 54, 'fish': 55, 'flour': 56, 'garlic': 57,
-    'ginger': 58, 'gourd': 59,
-    
-    # Fruits, Meats, and Dairy (60-89)
-    'grape': 60, 'green_bean': 61, 'green_grape': 62, 'ham': 63,
-    'guava': 64,  'jalapeno': 65, 'jam': 66, 'ketchup': 67, 'kiwi': 68,
-    'ladyfinger': 69, 'lemon': 70, 'lettuce': 71, 'lime': 72, 'lobster': 73,
-    'mandarin_orange': 74, 'mango': 75, 'mangosteen': 76, 'mayonnaise': 77,
-    'meat': 78, 'meat_ball': 79, 'medjool_dates': 80, 'melon': 81, 'milk': 82,
-    'mozarella_cheese': 83, 'mushroom': 84, 'mussel': 85, 'mustard': 86,
-    'noodle': 87, 'oil': 88, 'olive_oil': 89, 
-    
-    # Produce and Staples (90-139)
-    'onion': 90, 'orange': 91, 'oyster': 92, 'papaya': 93, 'paprika': 94,
-    'parmesan_cheese': 95, 'pasta': 96, 'pea': 97, 'peach': 98, 'pear': 99,
-    'persimmon': 100, 'pickle': 101, 'pineapple': 102, 'pomegranate': 103,
-    'pork': 104, 'pork_belly': 105, 'pork_rib': 106, 'potato': 107,
-    'prune': 108, 'pumpkin': 109, 'radish': 110, 'raspberry': 111,
-    'red_beans': 112, 'red_pepper': 113, 'rice': 114, 'rice_vinegar': 115,
-    'salad': 116, 'salmon': 117, 'salt': 118, 'scallop': 119, 'shrimp': 120,
-    'soy_sauce': 121, 'spaghetti': 122, 'spinach': 123, 'spring_onion': 124,
-    'starfruit': 125, 'stilton_cheese': 126, 'strawberry': 127, 'sweetcorn': 128,
-    'sweet_potato': 129, 'tomato': 130, 'tuna': 131, 'turnip': 132,
-    'vegetable': 133, 'vegetable_oil': 134, 'watermelon': 135, 'white_sugar': 136,
-    'yeast': 137, 'yogurt': 138, 'zucchini': 139 
-}
+# How images are placed in DEST_ROOT: 'hardlink', 'symlink', 'reflink' or 'copy' (links fall back to copy across filesystems)
+MATERIALIZE_MODE = 'hardlink'
+
+# MASTER_NAMES (Full list of 140 classes for mapping), shared with rename.py through taxonomy.yaml
+TAXONOMY = load_taxonomy()
+MASTER_NAMES = TAXONOMY.master_index
 
 # Reverse mapping: Index -> Name
-MASTER_ID_TO_NAME = {index: name for name, index in MASTER_NAMES.items()}
+MASTER_ID_TO_NAME = TAXONOMY.master_id_to_name()
 
 
 # --- SAMPLE COUNTS (Copied directly from your last output) ---
@@ -83,132 +47,190 @@ SAMPLE_COUNTS = {
 # 2. FILE OPERATION LOGIC (Balancing)
 # ====================================================================
 
-def balance_dataset():
-    print(f"--- Starting Dataset Balancing (Min: {MIN_SAMPLES}, Max: {MAX_SAMPLES}) ---")
+def build_inverted_index(annotations):
+    """
+    Builds both lookups in a single pass over the annotation index:
+    class_to_stems {master_id: set(stems)} and stem_to_classes {stem: set(master_ids)}.
+    """
+    class_to_stems = defaultdict(set)
+    stem_to_classes = defaultdict(set)
     
-    # 1. Filter Classes based on Min Threshold and Find Image Stems
-    images_to_keep_by_class = {}  # {master_id: [list of unique image stems]}
+    for stem, master_id in annotations.select('stem', 'class_id').unique().iter_rows():
+        class_to_stems[master_id].add(stem)
+        stem_to_classes[stem].add(master_id)
+    
+    return class_to_stems, stem_to_classes
+
+
+def select_images_to_keep(class_to_stems, sample_counts=SAMPLE_COUNTS, min_samples=MIN_SAMPLES, max_samples=MAX_SAMPLES):
+    """
+    Applies the MIN/MAX thresholds to every class and returns (kept_master_indices, images_to_keep).
+    images_to_keep is the union of every surviving class's (possibly sampled) stems.
+    """
     kept_master_indices = set()
+    images_to_keep = set()
     
-    for master_id, total_count in SAMPLE_COUNTS.items():
+    for master_id, total_count in sample_counts.items():
         master_name = MASTER_ID_TO_NAME[master_id]
         
         # Check 1: Minimum Threshold
-        if total_count < MIN_SAMPLES:
-            print(f"[DISCARDED] ID {master_id: <4} ({master_name: <20}): Below MIN ({total_count} < {MIN_SAMPLES})")
+        if total_count < min_samples:
+            print(f"[DISCARDED] ID {master_id: <4} ({master_name: <20}): Below MIN ({total_count} < {min_samples})")
             continue
-            
-        # Class is kept; find all image stems containing this class
-        image_stems_for_class = []
-        for split in SPLITS:
-            labels_dir = SOURCE_ROOT / split / 'labels'
-            if not labels_dir.exists(): continue
-            
-            for label_file in labels_dir.glob('*.txt'):
-                try:
-                    with open(label_file, 'r') as f:
-                        if any(line.startswith(f"{master_id} ") for line in f):
-                            # The file stem is the unique image identifier (e.g., dataset1_imgX)
-                            image_stems_for_class.append(label_file.stem)
-                except Exception as e:
-                    print(f"Error reading {label_file}: {e}")
-                    
         
-        # 2. Apply Maximum Sampling (Down-sampling)
-        unique_stems = list(set(image_stems_for_class))
+        # Sorted so the seeded sample does not depend on set iteration order
+        unique_stems = sorted(class_to_stems.get(master_id, ()))
         
-        if len(unique_stems) > MAX_SAMPLES:
+        # Check 2: Maximum Sampling (Down-sampling)
+        if len(unique_stems) > max_samples:
             random.seed(42) # Ensure deterministic sampling
-            unique_stems = random.sample(unique_stems, MAX_SAMPLES)
+            unique_stems = random.sample(unique_stems, max_samples)
             print(f"[SAMPLED] ID {master_id: <4} ({master_name: <20}): Reduced from {total_count} to {len(unique_stems)} images.")
         else:
             print(f"[KEPT]    ID {master_id: <4} ({master_name: <20}): {len(unique_stems)} images.")
-            
-        images_to_keep_by_class[master_id] = unique_stems
+        
+        images_to_keep.update(unique_stems)
         kept_master_indices.add(master_id)
+    
+    return kept_master_indices, images_to_keep
 
 
-    # 3. Aggregate Final Image List and Annotations
-    final_image_stems = {} # {stem: original_split}
-    final_annotations = {} # {stem: set_of_new_lines}
+def remap_label_lines(label_path, old_to_new_lut):
+    """Reads one master-id label file and returns its annotations as a set of lines with the new class ids."""
+    with open(label_path, 'r') as f:
+        rows = [parts for parts in (line.strip().split() for line in f) if len(parts) >= 5]
+    if not rows:
+        return set()
+    
+    # Only keep annotations for classes that survived the MIN filter (one lookup for the whole file)
+    new_class_ids, keep = remap([int(parts[0]) for parts in rows], old_to_new_lut)
+    return {f"{new_class_id} {' '.join(parts[1:])}"
+            for new_class_id, parts, kept in zip(new_class_ids.tolist(), rows, keep.tolist()) if kept}
+
+
+def format_label_text(annotations):
+    """Label file content for a set of annotation lines (sorted, so reruns produce identical files)."""
+    return ''.join(line + '\n' for line in sorted(list(annotations)))
+
+
+def check_against_final_names(sorted_kept_indices):
+    """Warns when the classes kept by this run differ from the 'final' list in taxonomy.yaml (what count.py etc. expect)."""
+    kept_names = [MASTER_ID_TO_NAME[master_id] for master_id in sorted_kept_indices]
+    if kept_names != TAXONOMY.final_names:
+        added = sorted(set(kept_names) - set(TAXONOMY.final_names))
+        missing = sorted(set(TAXONOMY.final_names) - set(kept_names))
+        print(f"⚠️  Kept classes differ from taxonomy.yaml 'final' ({len(kept_names)} vs {len(TAXONOMY.final_names)}); "
+              f"added: {added}, missing: {missing}. Update taxonomy.yaml if this is intended.")
+
+
+def remove_stale_outputs(dest_split_dir, written_stems):
+    """Deletes labels/images left in a destination split by an earlier run that are no longer selected."""
+    removed = 0
+    for sub_dir in ('labels', 'images'):
+        directory = dest_split_dir / sub_dir
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if stem not in written_stems and ext != '.tmp':
+                    os.unlink(entry.path)
+                    removed += 1
+    return removed
+
+
+def balance_dataset(source_root=SOURCE_ROOT, dest_root=DEST_ROOT, sample_counts=SAMPLE_COUNTS):
+    """
+    Builds the balanced dataset in dest_root. Reruns are incremental: unchanged labels are not rewritten,
+    images already linked are skipped and files from an earlier selection are removed.
+    """
+    print(f"--- Starting Dataset Balancing (Min: {MIN_SAMPLES}, Max: {MAX_SAMPLES}) ---")
+    
+    # 1. Build the class <-> image lookups in one pass over the shared annotation index
+    annotations = load_annotation_index(source_root, splits=SPLITS)
+    # Near-duplicate copies (image_dedup.py --exclude) and corrupt images (image_integrity.py) never enter the selection
+    excluded = load_exclusions(source_root)
+    if excluded:
+        annotations = drop_stems(annotations, excluded)
+        print(f"Skipping {len(excluded)} excluded images (duplicates / corrupt files)")
+    class_to_stems, stem_to_classes = build_inverted_index(annotations)
+    
+    # 2. Filter Classes (MIN) and sample them (MAX) with set operations
+    kept_master_indices, images_to_keep = select_images_to_keep(class_to_stems, sample_counts)
+    
+    # Images pulled in by another class can push a sampled class above MAX; report it
+    final_images_per_class = defaultdict(int)
+    for stem in images_to_keep:
+        for master_id in stem_to_classes[stem] & kept_master_indices:
+            final_images_per_class[master_id] += 1
+    over_max = sum(1 for count in final_images_per_class.values() if count > MAX_SAMPLES)
+    print(f"\n{len(images_to_keep)} images selected; {over_max} classes exceed MAX through co-occurring images.")
     
     # Create output directories
     for split in SPLITS:
-        (DEST_ROOT / split / 'images').mkdir(parents=True, exist_ok=True)
-        (DEST_ROOT / split / 'labels').mkdir(parents=True, exist_ok=True)
+        (dest_root / split / 'images').mkdir(parents=True, exist_ok=True)
+        (dest_root / split / 'labels').mkdir(parents=True, exist_ok=True)
 
     
-    # Create the mapping for the NEW contiguous indices
+    # Create the mapping for the NEW contiguous indices (master id -> new id lookup table)
     sorted_kept_indices = sorted(list(kept_master_indices))
-    old_to_new_index_map = {old_id: new_id for new_id, old_id in enumerate(sorted_kept_indices)}
+    old_to_new_lut = TAXONOMY.subset_lut(sorted_kept_indices)
+    check_against_final_names(sorted_kept_indices)
     
     
-    # 4. Process and Rewrite Labels
+    # 3. Process and Rewrite Labels
     total_images_processed = 0
+    labels_written = 0
+    stale_removed = 0
     
-    # PHASE 2: Rewrite files based on the sampling decision
+    # PHASE 2: Rewrite files based on the sampling decision (one pass over the tree)
+    materializer = Materializer(MATERIALIZE_MODE, incremental=True)
     for split in SPLITS:
-        source_labels_dir = SOURCE_ROOT / split / 'labels'
-        source_images_dir = SOURCE_ROOT / split / 'images'
+        source_labels_dir = source_root / split / 'labels'
+        source_images_dir = source_root / split / 'images'
+        image_catalog = ImageCatalog(source_images_dir) # One directory read per split
+        written_stems = set()
         
         for stem in tqdm(os.listdir(source_labels_dir), desc=f"Rewriting {split} split"):
             stem = Path(stem).stem
             
             # Check if this image stem belongs to ANY class that survived the filter
-            is_kept = False
-            for master_id in images_to_keep_by_class.keys():
-                if stem in images_to_keep_by_class[master_id]:
-                    is_kept = True
-                    break
-
-            if is_kept:
-                # Read the original label file
-                original_label_path = source_labels_dir / f"{stem}.txt"
-                new_annotations = set()
-                
-                with open(original_label_path, 'r') as f:
-                    for line in f:
-                        parts = line.strip().split()
-                        if len(parts) < 5: continue
-                        
-                        old_master_id = int(parts[0])
-                        
-                        # Only keep annotations for classes that survived the MIN filter
-                        if old_master_id in old_to_new_index_map:
-                            new_class_id = old_to_new_index_map[old_master_id]
-                            annotation_data = ' '.join(parts[1:])
-                            new_annotations.add(f"{new_class_id} {annotation_data}")
-                            
-                
-                # --- Copy and Write ---
+            if stem not in images_to_keep:
+                continue
+
+            # Read the original label file
+            new_annotations = remap_label_lines(source_labels_dir / f"{stem}.txt", old_to_new_lut)
+            
+            # --- Link and Write ---
+            
+            # Link (or copy) the image, whatever its extension
+            source_path = image_catalog.get(stem)
+
+            if source_path is not None:
+                materializer.submit(source_path, dest_root / split / 'images' / source_path.name)
                 
-                # Copy the image (assuming .jpg for simplicity, generalize if necessary)
-                original_image_path_jpg = source_images_dir / f"{stem}.jpg"
-                original_image_path_png = source_images_dir / f"{stem}.png"
+                # Write the new label file (skipped if an earlier run already wrote the same content)
+                dest_label_path = dest_root / split / 'labels' / f"{stem}.txt"
+                label_text = format_label_text(new_annotations)
+                labels_written += write_text_if_changed(dest_label_path, label_text)
                 
-                source_path = original_image_path_jpg if original_image_path_jpg.exists() else original_image_path_png
-
-                if source_path.exists():
-                    shutil.copy(source_path, DEST_ROOT / split / 'images' / source_path.name)
-                    
-                    # Write the new label file
-                    dest_label_path = DEST_ROOT / split / 'labels' / f"{stem}.txt"
-                    with open(dest_label_path, 'w') as f:
-                        f.writelines(line + '\n' for line in sorted(list(new_annotations)))
-                    
-                    total_images_processed += 1
+                written_stems.add(stem)
+                total_images_processed += 1
+        
+        materializer.flush()
+        stale_removed += remove_stale_outputs(dest_root / split, written_stems)
+    
+    materializer.close()
                     
-    # 5. Create Final YAML
+    # 4. Create Final YAML
     final_nc = len(sorted_kept_indices)
-    final_names_list = {new_id: MASTER_ID_TO_NAME[old_id] for old_id, new_id in old_to_new_index_map.items()}
+    final_names_list = {new_id: MASTER_ID_TO_NAME[old_id] for new_id, old_id in enumerate(sorted_kept_indices)}
 
     yaml_content = f"""
 # Final data.yaml for Ingredient Object Detection Training
 # Generated after balancing (nc: {final_nc}, Min: {MIN_SAMPLES}, Max: {MAX_SAMPLES}).
 
-train: {DEST_ROOT.name}/train/images
-val: {DEST_ROOT.name}/val/images
-test: {DEST_ROOT.name}/test/images
+train: {dest_root.name}/train/images
+val: {dest_root.name}/val/images
+test: {dest_root.name}/test/images
 
 nc: {final_nc}
 
@@ -217,12 +239,13 @@ names:
     for index in sorted(final_names_list.keys()):
         yaml_content += f"  {index}: {final_names_list[index]}\n"
 
-    yaml_path = DEST_ROOT / 'data.yaml'
-    with open(yaml_path, 'w') as f:
-        f.write(yaml_content)
+    yaml_path = dest_root / 'data.yaml'
+    write_text_if_changed(yaml_path, yaml_content)
         
     print(f"\n✅ Balancing Complete! Total images in new dataset: {total_images_processed}")
-    print(f"   New dataset located at: {DEST_ROOT.name} (Classes Kept: {final_nc})")
+    print(f"   New dataset located at: {dest_root.name} (Classes Kept: {final_nc})")
+    print(f"   Labels: {labels_written} written, {total_images_processed - labels_written} unchanged, {stale_removed} stale files removed")
+    print(f"   Images: {materializer.report()}")
 
 if __name__ == "__main__":
     balance_dataset()
\ No newline at end of file
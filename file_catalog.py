@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+
+# --- Configuration ---
+# Every image suffix Ultralytics can train on. The order is the preference when one stem has several files
+# (.jpg before .png matches what the merge scripts always picked).
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg', '.bmp', '.webp', '.tif', '.tiff', '.dng', '.mpo', '.heic', '.pfm')
+_EXTENSION_RANK = {ext: rank for rank, ext in enumerate(IMAGE_EXTENSIONS)}
+
+
+class ImageCatalog:
+    """
+    Maps image stem -> (path, size) for one images/ directory.
+    The directory is read once with os.scandir, so lookups need no further stat/exists calls
+    (sizes come from the cached DirEntry: free on Windows, one lstat on first use elsewhere).
+    """
+
+    def __init__(self, images_dir):
+        self.images_dir = Path(images_dir)
+        self._entries = {}  # {stem: (path, DirEntry, extension rank)}
+        self.duplicates = 0  # Stems that exist with more than one image extension
+
+        if not self.images_dir.exists():
+            return
+
+        with os.scandir(self.images_dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                rank = _EXTENSION_RANK.get(ext.lower())
+                if rank is None or not entry.is_file():
+                    continue
+
+                existing = self._entries.get(stem)
+                if existing is not None:
+                    self.duplicates += 1
+                    if existing[2] <= rank:
+                        continue
+                self._entries[stem] = (Path(entry.path), entry, rank)
+
+    def get(self, stem):
+        """Returns the image path for `stem`, or None if there is no image."""
+        entry = self._entries.get(stem)
+        return entry[0] if entry else None
+
+    def size(self, stem):
+        """Returns the file size in bytes for `stem`, or None if there is no image."""
+        entry = self._entries.get(stem)
+        return entry[1].stat().st_size if entry else None
+
+    def remove(self, stem):
+        """Forgets `stem` (call after deleting or moving its file)."""
+        self._entries.pop(stem, None)
+
+    def stems(self):
+        return self._entries.keys()
+
+    def __contains__(self, stem):
+        return stem in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,273 @@
+import os
+import json
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from tqdm import tqdm
+from annotation_index import EXCLUSIONS_FILENAME
+
+# --- Configuration ---
+# Hash the merged dataset (the input of the balancing scripts) so duplicates are removed before sampling
+DATASET_ROOT = Path('./merged_final_data_full')
+SPLITS = ['train', 'val', 'test']
+HASH_WORKERS = 8  # Decode threads (cv2 releases the GIL while decoding)
+
+# The index is stored next to the splits it describes and only re-hashes images whose size/mtime changed
+INDEX_FILENAME = 'image_hashes.json'
+INDEX_VERSION = 1
+
+# 64-bit pHash: two photos are near duplicates if their hashes differ in at most HAMMING_RADIUS bits
+HAMMING_RADIUS = 4
+HASH_SIZE = 8  # 8x8 low-frequency DCT block -> 64 bits
+DCT_SIZE = 32  # Image is reduced to 32x32 grayscale before the DCT
+
+# Which copy of a duplicate cluster survives: validation/test copies win (their sizes are fixed),
+# then the largest file (usually the least recompressed one)
+KEEP_PRIORITY = {'val': 0, 'test': 1, 'train': 2}
+
+
+# ====================================================================
+# 1. PERCEPTUAL HASH
+# ====================================================================
+
+def phash(image_path):
+    """64-bit DCT perceptual hash as a Python int, or None if the image cannot be decoded."""
+    # Decoding at 1/8 scale lets libjpeg skip most of the IDCT work; the hash only needs 32x32 pixels
+    image = cv2.imread(str(image_path), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        image = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    small = cv2.resize(image, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])  # The DC term only carries the brightness, keep it out of the median
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+# ====================================================================
+# 2. MULTI-INDEX HASH (fast Hamming-radius queries)
+# ====================================================================
+
+class HashIndex:
+    """
+    Multi-index hashing over 64-bit hashes: the bits are cut into radius+1 chunks, so by the pigeonhole
+    principle two hashes within `radius` bits agree exactly on at least one chunk. Candidates are the
+    entries sharing a chunk value; the exact distance is then checked with a vectorized popcount.
+    """
+
+    def __init__(self, hashes, radius=HAMMING_RADIUS):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = radius
+        n_chunks = radius + 1
+        bounds = np.linspace(0, 64, n_chunks + 1).astype(np.uint64)
+        self._chunks = list(zip(bounds[:-1], bounds[1:] - bounds[:-1]))
+        # Per chunk: entries sorted by chunk value, for searchsorted lookups
+        self._tables = []
+        for shift, width in self._chunks:
+            values = self._chunk_values(self.hashes, shift, width)
+            order = np.argsort(values, kind='stable')
+            self._tables.append((values[order], order))
+
+    @staticmethod
+    def _chunk_values(hashes, shift, width):
+        mask = np.uint64((1 << int(width)) - 1)
+        return (hashes >> shift) & mask
+
+    def query(self, hash_value, radius=None):
+        """Indices of every stored hash within `radius` bits of hash_value (radius <= the build radius)."""
+        radius = self.radius if radius is None else min(radius, self.radius)
+        hash_value = np.uint64(hash_value)
+        candidates = []
+        for (shift, width), (values, order) in zip(self._chunks, self._tables):
+            key = self._chunk_values(hash_value, shift, width)
+            start, end = np.searchsorted(values, [key, key + np.uint64(1)])
+            candidates.append(order[start:end])
+        candidates = np.unique(np.concatenate(candidates))
+        distances = np.bitwise_count(self.hashes[candidates] ^ hash_value)
+        return candidates[distances <= radius]
+
+    def all_pairs(self, radius=None):
+        """(i, j) arrays with i < j for every pair of stored hashes within `radius` bits, without a Python loop."""
+        radius = self.radius if radius is None else min(radius, self.radius)
+        pairs = []
+        for values, order in self._tables:
+            _, group_sizes = np.unique(values, return_counts=True)
+            starts = np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+            partners = np.repeat(group_sizes, group_sizes) - 1 - (np.arange(len(values)) - starts)
+            first = np.repeat(np.arange(len(values)), partners)
+            second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(partners) - partners, partners)
+            i, j = order[first], order[second]
+            close = np.bitwise_count(self.hashes[i] ^ self.hashes[j]) <= radius
+            pairs.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1)[close])
+        if not pairs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        unique_pairs = np.unique(np.concatenate(pairs), axis=0)  # A pair can match on several chunks
+        return unique_pairs[:, 0], unique_pairs[:, 1]
+
+
+# ====================================================================
+# 3. PERSISTENT IMAGE HASH INDEX
+# ====================================================================
+
+class ImageHashIndex:
+    """
+    Persistent 'split/stem' -> pHash store for a YOLO dataset (like ClassLookup, keyed on size/mtime),
+    so `update()` only decodes images that are new or changed since the last run.
+    """
+
+    def __init__(self, dataset_root=DATASET_ROOT, splits=SPLITS):
+        self.dataset_root = Path(dataset_root)
+        self.splits = list(splits)
+        self.path = self.dataset_root / INDEX_FILENAME
+        # {'train/dataset1_0001': {'file': 'dataset1_0001.jpg', 'mtime': ns, 'size': bytes, 'hash': '0f3a...'}}
+        self.files = {}
+
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            if stored.get('version') == INDEX_VERSION:
+                self.files = stored['files']
+
+    def update(self, workers=HASH_WORKERS):
+        """Hashes new or modified images in parallel, drops deleted ones and saves. Returns (hashed, removed)."""
+        seen = set()
+        to_hash = []
+        for split in self.splits:
+            images_dir = self.dataset_root / split / 'images'
+            if not images_dir.exists():
+                continue
+            with os.scandir(images_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name.endswith('.npy'):
+                        continue
+                    key = f"{split}/{os.path.splitext(entry.name)[0]}"
+                    seen.add(key)
+                    stat = entry.stat()
+                    record = self.files.get(key)
+                    if record and record['mtime'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                        continue
+                    to_hash.append((key, entry.path, entry.name, stat))
+
+        undecodable = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = pool.map(lambda item: phash(item[1]), to_hash)
+            for (key, _, name, stat), hash_value in tqdm(zip(to_hash, hashes), total=len(to_hash), desc="Hashing images"):
+                if hash_value is None:
+                    undecodable += 1
+                    self.files.pop(key, None)
+                    continue
+                self.files[key] = {'file': name, 'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+                                   'hash': f"{hash_value:016x}"}
+        if undecodable:
+            print(f"⚠️  {undecodable} images could not be decoded and were not hashed")
+
+        removed = [key for key in self.files if key.split('/', 1)[0] in self.splits and key not in seen]
+        for key in removed:
+            del self.files[key]
+
+        if to_hash or removed or not self.path.exists():
+            self.save()
+        return len(to_hash) - undecodable, len(removed)
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
+    def arrays(self):
+        """Returns (keys sorted, uint64 hash array) for building a HashIndex."""
+        keys = sorted(self.files)
+        return keys, np.array([int(self.files[key]['hash'], 16) for key in keys], dtype=np.uint64)
+
+
+# ====================================================================
+# 4. CLUSTERS, LEAKAGE AND EXCLUSIONS
+# ====================================================================
+
+def find_clusters(keys, hashes, radius=HAMMING_RADIUS):
+    """Groups near-duplicate images (connected components of the within-radius graph). Returns [[key, ...], ...]."""
+    i, j = HashIndex(hashes, radius).all_pairs()
+    graph = coo_matrix((np.ones(len(i), dtype=np.int8), (i, j)), shape=(len(keys), len(keys)))
+    _, component = connected_components(graph, directed=False)
+    members = defaultdict(list)
+    for key, component_id in zip(keys, component):
+        members[component_id].append(key)
+    return [sorted(cluster) for cluster in members.values() if len(cluster) > 1]
+
+
+def choose_exclusions(clusters, files):
+    """One image per cluster is kept (KEEP_PRIORITY split first, then the largest file); returns the other keys."""
+    excluded = []
+    for cluster in clusters:
+        keeper = min(cluster, key=lambda key: (KEEP_PRIORITY.get(key.split('/', 1)[0], len(KEEP_PRIORITY)),
+                                               -files[key]['size'], key))
+        excluded.extend(key for key in cluster if key != keeper)
+    return sorted(excluded)
+
+
+def summarize_clusters(clusters):
+    """Returns (within-split clusters, cross-split (leaking) clusters)."""
+    within, leaking = [], []
+    for cluster in clusters:
+        splits = {key.split('/', 1)[0] for key in cluster}
+        (leaking if len(splits) > 1 else within).append(cluster)
+    return within, leaking
+
+
+def write_exclusions(dataset_root, excluded_keys, radius=HAMMING_RADIUS):
+    """Writes the stems the balancing scripts should skip (one per line, read back by annotation_index.load_exclusions)."""
+    path = Path(dataset_root) / EXCLUSIONS_FILENAME
+    lines = [f"# Near-duplicate images (pHash, Hamming radius {radius}) written by image_dedup.py\n"]
+    lines += [f"{key.split('/', 1)[1]}\n" for key in excluded_keys]
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate image clusters and cross-split leakage (pHash).")
+    parser.add_argument('dataset_root', type=Path, nargs='?', default=DATASET_ROOT)
+    parser.add_argument('--radius', type=int, default=HAMMING_RADIUS, help="Max differing bits of a near duplicate")
+    parser.add_argument('--exclude', action='store_true',
+                        help=f"Write {EXCLUSIONS_FILENAME} so discard.py / views.py skip the duplicate copies")
+    parser.add_argument('--show', type=int, default=10, help="Clusters printed per category")
+    args = parser.parse_args()
+
+    print(f"--- Hashing images in: {args.dataset_root} ---")
+    index = ImageHashIndex(args.dataset_root)
+    hashed, removed = index.update()
+    keys, hashes = index.arrays()
+    print(f"Index: {len(keys)} images ({hashed} hashed, {removed} removed, {len(keys) - hashed} reused)")
+
+    clusters = find_clusters(keys, hashes, args.radius)
+    within, leaking = summarize_clusters(clusters)
+    excluded = choose_exclusions(clusters, index.files)
+
+    print(f"\n--- Duplicate clusters within one split: {len(within)} ({sum(len(c) for c in within)} images) ---")
+    for cluster in within[:args.show]:
+        print(f"   {', '.join(cluster)}")
+    print(f"\n--- Cross-split leakage: {len(leaking)} clusters ({sum(len(c) for c in leaking)} images) ---")
+    leak_counts = defaultdict(int)
+    for cluster in leaking:
+        leak_counts[' + '.join(sorted({key.split('/', 1)[0] for key in cluster}))] += 1
+    for combination, count in sorted(leak_counts.items()):
+        print(f"   {combination}: {count} clusters")
+    for cluster in leaking[:args.show]:
+        print(f"   {', '.join(cluster)}")
+
+    print(f"\n💡 Keeping one image per cluster would exclude {len(excluded)} images")
+    if args.exclude:
+        path = write_exclusions(args.dataset_root, excluded, args.radius)
+        print(f"✅ Exclusions written to {path}; discard.py and views.py will skip them")
+
+
+if __name__ == '__main__':
+    main()
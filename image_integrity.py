@@ -0,0 +1,178 @@
+import os
+import json
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from tqdm import tqdm
+import rename
+from annotation_index import CORRUPT_FILENAME
+from file_catalog import IMAGE_EXTENSIONS
+
+# --- Configuration ---
+# Every source dataset rename.py merges, plus the merged output discard.py balances
+DATASET_ROOTS = [rename.SOURCE_ROOT / ds_name for ds_name in rename.DATASET_NAMES] + [rename.DEST_ROOT]
+SPLITS = ['train', 'val', 'test']
+WORKERS = None  # Decoder processes (None = one per CPU core)
+FILES_PER_CHUNK = 256  # Images handed to one worker task
+
+# Results are cached next to the splits they describe and keyed on size/mtime, so reruns only check new files
+CACHE_FILENAME = 'image_integrity.json'
+CACHE_VERSION = 1
+MIN_IMAGE_SIDE = 10  # Ultralytics rejects images smaller than this
+
+
+# ====================================================================
+# 1. CHECKS (run in worker processes)
+# ====================================================================
+
+def check_image(path):
+    """Returns None if the image is usable, otherwise a short reason (header, size, truncation or decode error)."""
+    try:
+        if os.path.getsize(path) == 0:
+            return 'empty file'
+
+        # 1. Header: format and size, without decoding the pixels
+        with Image.open(path) as im:
+            im.verify()
+            if min(im.size) < MIN_IMAGE_SIDE:
+                return f"image too small {im.size}"
+            image_format = im.format
+
+        # 2. JPEGs must end with the EOI marker; a missing one means the file was cut off
+        if image_format == 'JPEG':
+            with open(path, 'rb') as f:
+                f.seek(-2, os.SEEK_END)
+                if f.read() != b'\xff\xd9':
+                    return 'truncated JPEG (no EOI marker)'
+
+        # 3. Full decode (verify() leaves the file unusable, so reopen). JPEG draft mode decodes at 1/8 scale:
+        # the whole bitstream is still read, so truncation and corrupt scans still fail, at a fraction of the cost.
+        with Image.open(path) as im:
+            if image_format == 'JPEG':
+                im.draft(im.mode, (max(1, im.width // 8), max(1, im.height // 8)))
+            im.load()
+    except Exception as e:  # PIL raises many types (OSError, SyntaxError, ValueError, DecompressionBombError...)
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def check_chunk(paths):
+    """Worker: checks a chunk of images. Returns [error or None] in the same order."""
+    return [check_image(path) for path in paths]
+
+
+# ====================================================================
+# 2. CACHED SCAN OF ONE DATASET ROOT
+# ====================================================================
+
+class IntegrityCache:
+    """
+    Persistent 'split/images/name' -> check result store for one dataset root (keyed on size/mtime,
+    like class_lookup.json), so `scan()` only decodes images that are new or changed.
+    """
+
+    def __init__(self, dataset_root, splits=SPLITS):
+        self.dataset_root = Path(dataset_root)
+        self.splits = list(splits)
+        self.path = self.dataset_root / CACHE_FILENAME
+        # {'train/images/dataset1_0001.jpg': {'mtime': ns, 'size': bytes, 'error': None or reason}}
+        self.files = {}
+
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            if stored.get('version') == CACHE_VERSION:
+                self.files = stored['files']
+
+    def scan(self, pool):
+        """Checks new or modified images on `pool`, drops deleted ones and saves. Returns (checked, removed)."""
+        seen = set()
+        to_check = []
+        for split in self.splits:
+            images_dir = self.dataset_root / split / 'images'
+            if not images_dir.exists():
+                continue
+            with os.scandir(images_dir) as entries:
+                for entry in entries:
+                    if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS or not entry.is_file():
+                        continue
+                    key = f"{split}/images/{entry.name}"
+                    seen.add(key)
+                    stat = entry.stat()
+                    record = self.files.get(key)
+                    if record and record['mtime'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                        continue
+                    to_check.append((key, entry.path, stat))
+
+        chunks = [to_check[i:i + FILES_PER_CHUNK] for i in range(0, len(to_check), FILES_PER_CHUNK)]
+        results = pool.map(check_chunk, [[path for _, path, _ in chunk] for chunk in chunks])
+        for chunk, errors in tqdm(zip(chunks, results), total=len(chunks), desc=f"Checking {self.dataset_root}"):
+            for (key, _, stat), error in zip(chunk, errors):
+                self.files[key] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'error': error}
+
+        removed = [key for key in self.files if key.split('/', 1)[0] in self.splits and key not in seen]
+        for key in removed:
+            del self.files[key]
+
+        if to_check or removed or not self.path.exists():
+            self.save()
+        return len(to_check), len(removed)
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
+    def corrupt(self):
+        """{key: reason} for every image that failed a check."""
+        return {key: record['error'] for key, record in sorted(self.files.items()) if record['error']}
+
+
+def write_corrupt_list(dataset_root, corrupt):
+    """Writes the stems rename.py / discard.py / views.py skip (read back by annotation_index.load_exclusions)."""
+    path = Path(dataset_root) / CORRUPT_FILENAME
+    lines = ["# Images that failed image_integrity.py; each stem follows a comment with its path and the reason\n"]
+    for key, reason in corrupt.items():
+        lines.append(f"# {key}: {reason}\n")
+        lines.append(f"{os.path.splitext(key.rsplit('/', 1)[1])[0]}\n")
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find corrupt or truncated images (cached, parallel).")
+    parser.add_argument('dataset_roots', type=Path, nargs='*', default=DATASET_ROOTS,
+                        help="Roots with <split>/images folders (default: rename.py sources and merged output)")
+    parser.add_argument('--rescan', action='store_true', help="Ignore the cache and check every image again")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        for dataset_root in args.dataset_roots:
+            if not dataset_root.exists():
+                continue
+            cache = IntegrityCache(dataset_root)
+            if args.rescan:
+                cache.files = {}
+            checked, removed = cache.scan(pool)
+            corrupt = cache.corrupt()
+            print(f"--- {dataset_root}: {len(cache.files)} images ({checked} checked, "
+                  f"{len(cache.files) - checked} cached, {removed} removed) ---")
+            for key, reason in corrupt.items():
+                print(f"⚠️  {key}: {reason}")
+
+            corrupt_list = dataset_root / CORRUPT_FILENAME
+            if corrupt:
+                write_corrupt_list(dataset_root, corrupt)
+                print(f"✅ {len(corrupt)} corrupt images listed in {corrupt_list}")
+            else:
+                corrupt_list.unlink(missing_ok=True)  # Everything that was broken has been fixed or removed
+                print("✅ No corrupt images")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+from detector import CUSTOM_MODEL_PATH, BACKEND, load_model, result_record
+from detection_cache import DetectionCache, cache_key, content_digest, model_fingerprint
+from model_backends import BACKENDS
+
+# --- Configuration ---
+# A local HTTP service that keeps the model loaded; concurrent requests are grouped into micro-batches
+HOST = '127.0.0.1'
+PORT = 8765
+MAX_BATCH_SIZE = 8  # Images per forward pass
+MAX_WAIT_MS = 15  # Latency budget: how long the first queued image may wait for others to join its batch
+MAX_QUEUE_SIZE = 256  # Requests beyond this are rejected with 503 instead of piling up
+REQUEST_TIMEOUT_S = 30
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+IMGSZ = 640
+CONF = 0.25
+DEVICE = None  # None = Ultralytics default (GPU if available, else CPU)
+USE_CACHE = True  # Answer re-uploaded images from detection_cache.py without running the model
+
+
+# ====================================================================
+# 1. MICRO-BATCHING
+# ====================================================================
+
+class MicroBatcher:
+    """
+    Collects images from many request threads and runs them through the model together.
+    A batch is closed when it holds MAX_BATCH_SIZE images or MAX_WAIT_MS after its first image arrived,
+    whichever comes first, so a lone request waits at most the latency budget.
+    """
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_queue_size=MAX_QUEUE_SIZE, predict_args=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.predict_args = {'imgsz': IMGSZ, 'conf': CONF, 'device': DEVICE, 'verbose': False,
+                             **(predict_args or {})}
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self.stats = {'images': 0, 'batches': 0, 'inference_s': 0.0}
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, image):
+        """Queues one BGR image; returns a Future resolving to the image's Results. Raises queue.Full when busy."""
+        future = Future()
+        self._queue.put_nowait((image, future))
+        return future
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]  # Block until there is work
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            images = [image for image, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = self.model.predict(images, **self.predict_args)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            with self._stats_lock:
+                self.stats['images'] += len(batch)
+                self.stats['batches'] += 1
+                self.stats['inference_s'] += elapsed
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queued'] = self._queue.qsize()
+        stats['mean_batch_size'] = stats['images'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+# ====================================================================
+# 2. HTTP API
+# ====================================================================
+
+def detection_response(record):
+    """Same "count + ingredient" summary detector.py prints, as JSON (from a detector.result_record())."""
+    counts = record['counts']
+    return {
+        'total_objects': record['total_objects'],
+        'unique_classes': len(counts),
+        'items': sorted(f"{count} {item}" for item, count in counts.items()),
+        'counts': counts,
+    }
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect   body = raw image bytes (JPEG/PNG/...), or JSON {"path": "local/image.jpg"}
+    GET  /health   model path, batching and cache statistics
+    """
+    batcher = None  # Set by serve()
+    cache = None  # DetectionCache, set by serve() unless caching is off
+    fingerprint = None
+    model_path = CUSTOM_MODEL_PATH
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so clients do not reconnect per request
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_image_bytes(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length <= 0 or length > MAX_UPLOAD_BYTES:
+            raise ValueError(f"Request body must be 1 byte to {MAX_UPLOAD_BYTES} bytes")
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            payload = json.loads(body)
+            # open() of an int would use (and then close) one of the server's own file descriptors
+            if not isinstance(payload, dict) or not isinstance(payload.get('path'), str):
+                raise ValueError('JSON body must be {"path": "<image path>"}')
+            try:
+                with open(payload['path'], 'rb') as f:
+                    body = f.read()
+            except OSError as e:
+                raise ValueError(f"Could not read the image: {e}")
+            if not body:
+                raise ValueError("The image file is empty")
+        return body
+
+    def do_GET(self):
+        if self.path == '/health':
+            cache_stats = {'cache': self.cache.snapshot()} if self.cache else {}
+            self._send_json(200, {'status': 'ok', 'model': self.model_path, **self.batcher.snapshot(), **cache_stats})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/detect':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            data = self._read_image_bytes()
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        # A repeated upload is answered from the cache before anything is decoded
+        key = cache_key(content_digest(data), self.fingerprint, self.batcher.predict_args) if self.cache else None
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            self._send_json(200, detection_response(cached))
+            return
+
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)  # In the request thread
+        if image is None:
+            self._send_json(400, {'error': "Could not decode the image"})
+            return
+        try:
+            future = self.batcher.submit(image)
+        except queue.Full:
+            self._send_json(503, {'error': 'server busy, retry later'})
+            return
+        try:
+            record = result_record(None, future.result(timeout=REQUEST_TIMEOUT_S))
+        except Exception as e:
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        del record['image']
+        if self.cache:
+            self.cache.put(key, record)
+        self._send_json(200, detection_response(record))
+
+    def log_message(self, format, *args):
+        pass  # One line per request would cost more than the request itself; /health has the totals
+
+
+class DetectionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = MAX_QUEUE_SIZE  # The socketserver default listen backlog (5) resets bursts of clients
+
+
+def serve(host=HOST, port=PORT, model_path=CUSTOM_MODEL_PATH, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+          backend=BACKEND, use_cache=USE_CACHE):
+    model = load_model(model_path, backend)
+    # Warm-up: the first forward pass builds the fused model and allocates buffers, keep that out of a request
+    model.predict(np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8), imgsz=IMGSZ, device=DEVICE, verbose=False)
+
+    DetectionHandler.batcher = MicroBatcher(model, max_batch_size, max_wait_ms)
+    DetectionHandler.model_path = model_path
+    if use_cache:
+        DetectionHandler.cache = DetectionCache()
+        DetectionHandler.fingerprint = model_fingerprint(model_path, backend)
+    server = DetectionServer((host, port), DetectionHandler)
+    print(f"✅ Serving {model_path} ({backend}) on http://{host}:{port}/detect "
+          f"(batch <= {max_batch_size}, wait <= {max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the detector loaded and serve micro-batched predictions over HTTP.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--model', default=CUSTOM_MODEL_PATH)
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND)
+    parser.add_argument('--batch', type=int, default=MAX_BATCH_SIZE, help="Max images per forward pass")
+    parser.add_argument('--wait-ms', type=float, default=MAX_WAIT_MS, help="Latency budget for filling a batch")
+    parser.add_argument('--no-cache', action='store_true', help="Run the model on every request")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.model, args.batch, args.wait_ms, args.backend, use_cache=not args.no_cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import numpy as np
+from scipy import sparse
+
+# --- Configuration ---
+COLLATERAL_PENALTY = 1.0  # Score cost per instance removed from a class that is NOT over its target
+MAX_BATCH = 1024  # Images considered per greedy round
+RANDOM_SEED = 42
+
+
+def build_count_matrix(annotations):
+    """
+    Builds the sparse image x class instance-count matrix for one split.
+    Returns (stems[n_images], class_ids[n_classes], counts csr_matrix[n_images, n_classes]).
+    """
+    pairs = annotations.group_by('stem', 'class_id').len().sort('stem', 'class_id')
+    stems, image_idx = np.unique(pairs['stem'].to_numpy(), return_inverse=True)
+    class_ids, class_idx = np.unique(pairs['class_id'].to_numpy(), return_inverse=True)
+    counts = sparse.csr_matrix(
+        (pairs['len'].to_numpy().astype(np.int64), (image_idx, class_idx)),
+        shape=(len(stems), len(class_ids)),
+    )
+    return stems, class_ids, counts
+
+
+def _column_presence(matrix):
+    """Number of rows with a non-zero entry, per column."""
+    return np.asarray((matrix > 0).sum(axis=0)).ravel()
+
+
+def _column_sums(matrix):
+    return np.asarray(matrix.sum(axis=0)).ravel()
+
+
+def _rows_exceeding(matrix, limits):
+    """Rows of a CSR matrix with at least one entry above its column's limit."""
+    violates = matrix.data > limits[matrix.indices]
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    bad = np.zeros(matrix.shape[0], dtype=bool)
+    bad[rows[violates]] = True
+    return bad
+
+
+def plan_removals(counts, target_max, protect_threshold, seed=RANDOM_SEED):
+    """
+    Chooses one set of images to remove so that every class ends at or below `target_max` at the same time.
+
+    Greedy set cover over the sparse matrix: each round scores all candidate images at once
+    (instances of over-target classes they remove, minus a penalty for instances of other classes)
+    and walks the best-scoring images, taking each one that does not overshoot any class. The score is only
+    a preference: when no image removes more over-target instances than collateral, the best of the rest
+    is taken, so classes whose removable images are all mixed still reach the target (like the old
+    pure-then-mixed pass).
+    Protection follows the running totals: collateral never takes a class below `protect_threshold`,
+    and images containing a class already below it are never removed.
+    Returns (remove_mask[n_images], removable_mask[n_images], pure_mask[n_images]).
+    """
+    n_images = counts.shape[0]
+    rng = np.random.default_rng(seed)
+
+    totals = _column_sums(counts).astype(np.int64)
+    protected = totals < protect_threshold
+
+    # Initially removable: no protected class (reported by summarize_plan)
+    removable = (counts @ protected.astype(np.int64)) == 0
+    pure = np.diff(counts.indptr) == 1
+
+    # Random jitter breaks score ties (the old per-class shuffle), pure images get a small edge
+    jitter = rng.random(n_images) * 0.5 + pure * 0.5
+
+    removed = np.zeros(n_images, dtype=bool)
+    candidates = np.flatnonzero(removable)
+    over = np.maximum(totals - target_max, 0)
+
+    while over.any() and len(candidates):
+        active = over > 0
+        # How much each class may still lose: its excess if over target, otherwise what keeps it
+        # at or above the protection threshold (negative for classes already protected)
+        limits = np.where(active, np.iinfo(np.int64).max, totals - protect_threshold)
+        sub = counts[candidates]
+
+        # Both filters only tighten as totals fall, so dropped candidates never come back
+        touches_active = (sub @ active.astype(np.int64)) > 0
+        keep = touches_active & ~_rows_exceeding(sub, limits)
+        candidates, sub = candidates[keep], sub[keep]
+        if not len(candidates):
+            break
+
+        scores = sub @ np.where(active, 1.0, -COLLATERAL_PENALTY)
+        preferred = scores > 0
+        if preferred.any():
+            pool, pool_scores = candidates[preferred], scores[preferred]
+        else:
+            pool, pool_scores = candidates, scores  # Fallback: least net collateral first
+
+        order = np.argsort(-(pool_scores + jitter[pool]), kind='stable')[:MAX_BATCH]
+        top = pool[order]
+        block = counts[top].toarray()
+        limits = np.where(active, over, limits)
+
+        # Walk the ranked images and take every one that still fits all limits (skipping the ones that don't,
+        # so one nearly-exhausted class does not end the round); if even the best image overshoots an
+        # over-target class on its own, remove just that one
+        remaining = np.maximum(limits, 0)  # Classes already protected have no candidates left touching them
+        taken = []
+        for row, counts_row in enumerate(block):
+            if (counts_row <= remaining).all():
+                remaining -= counts_row
+                taken.append(row)
+        chosen = top[taken] if taken else top[:1]
+
+        removed[chosen] = True
+        totals -= _column_sums(counts[chosen]).astype(np.int64)
+        over = np.maximum(totals - target_max, 0)
+        candidates = candidates[~np.isin(candidates, chosen)]
+
+    return removed, removable, pure
+
+
+def summarize_plan(stems, class_ids, counts, removed, removable, pure, target_max):
+    """
+    Per-class before/after numbers for the plan (vectorized, no per-stem lookups).
+    Returns (stats for classes that were over target, collateral {class_id: instances lost}, stems to remove).
+    """
+    kept = ~removed
+    mixed = ~pure
+
+    before_instances = _column_sums(counts)
+    after_instances = _column_sums(counts[kept])
+    before_images = _column_presence(counts)
+    after_images = _column_presence(counts[kept])
+    pure_images = _column_presence(counts[pure])
+    pure_removed = _column_presence(counts[pure & removed])
+    mixed_removable = _column_presence(counts[mixed & removable])
+    protected_mixed_instances = _column_sums(counts[mixed & ~removable])
+
+    stats = []
+    collateral = {}
+    for col, class_id in enumerate(class_ids):
+        lost = int(before_instances[col] - after_instances[col])
+        if before_instances[col] <= target_max:
+            if lost:
+                collateral[int(class_id)] = lost
+            continue
+        stats.append({
+            'id': int(class_id),
+            'before_instances': int(before_instances[col]),
+            'before_images': int(before_images[col]),
+            'after_instances': int(after_instances[col]),
+            'after_images': int(after_images[col]),
+            'removed_images': int(before_images[col] - after_images[col]),
+            'removed_instances': lost,
+            'pure_images': int(pure_images[col]),
+            'pure_removed': int(pure_removed[col]),
+            'mixed_removable': int(mixed_removable[col]),
+            'protected_mixed_instances': int(protected_mixed_instances[col]),
+            'target': target_max,
+        })
+    return stats, collateral, set(stems[removed].tolist())
@@ -0,0 +1,214 @@
+import os
+import json
+import math
+import hashlib
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.cfg import get_cfg
+from ultralytics.data.utils import check_det_dataset
+from ultralytics.utils import LOGGER, TQDM, colorstr
+from ultralytics.utils.torch_utils import unwrap_model
+from ultralytics.utils.patches import imread
+
+# --- Configuration ---
+# Every image is decoded and resized (long side = imgsz) ONCE and stored as uint8 in memory-mapped .npy shards.
+# Training then slices the resized pixels straight out of the shard: no JPEG decode, no resize per epoch.
+CACHE_ROOT = Path('./letterbox_cache')
+CACHE_VERSION = 1  # Bump when the on-disk layout changes
+IMAGES_PER_SHARD = 1024  # 1024 x 640 x 640 x 3 bytes = ~1.2 GB per shard at imgsz 640
+BUILD_WORKERS = 8  # Threads decoding/resizing while the cache is built (cv2 releases the GIL)
+
+SHARD_PATTERN = 'images_{:05d}.npy'
+META_FILENAME = 'meta.json'
+SHAPES_FILENAME = 'shapes.npy'  # [N, 4] int32: original h, w and resized h, w
+STATS_FILENAME = 'stats.npy'  # [N, 2] int64: source file size and mtime_ns, to detect stale entries
+
+
+def _file_stats(im_files):
+    stats = np.zeros((len(im_files), 2), dtype=np.int64)
+    for i, im_file in enumerate(im_files):
+        stat = os.stat(im_file)
+        stats[i] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+
+def fingerprint(im_files, stats, imgsz):
+    """Identifies the exact cached content: the image list, each file's size/mtime, the size and the layout."""
+    sha = hashlib.sha256(f"{CACHE_VERSION}|{imgsz}".encode())
+    for im_file, (size, mtime_ns) in zip(im_files, stats):
+        sha.update(f"|{im_file}|{size}|{mtime_ns}".encode())
+    return sha.hexdigest()
+
+
+def cache_dir_for(img_path, imgsz, cache_root=CACHE_ROOT):
+    """One cache directory per dataset path and image size."""
+    key = hashlib.sha256(str(img_path).encode()).hexdigest()[:12]
+    return Path(cache_root) / f"{Path(str(img_path)).name}_{key}_{imgsz}"
+
+
+def _resize_image(im_file, imgsz):
+    im = imread(im_file)  # BGR, EXIF orientation applied like Ultralytics
+    if im is None:
+        raise FileNotFoundError(f"Image Not Found {im_file}")
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return im, (h0, w0)
+
+
+def build_cache(im_files, cache_dir, imgsz, workers=BUILD_WORKERS):
+    """
+    Resizes every image once and writes it top-left aligned into a [n, imgsz, imgsz, 3] uint8 shard.
+    Boxes need no rewrite: YOLO labels are normalized, and the loader returns exactly the resized
+    (unpadded) region, so they stay valid. Returns the cache fingerprint.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale in cache_dir.glob('images_*.npy'):
+        stale.unlink()
+    (cache_dir / META_FILENAME).unlink(missing_ok=True)
+
+    stats = _file_stats(im_files)
+    shapes = np.zeros((len(im_files), 4), dtype=np.int32)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for shard_start in range(0, len(im_files), IMAGES_PER_SHARD):
+            shard_files = im_files[shard_start:shard_start + IMAGES_PER_SHARD]
+            shard = np.lib.format.open_memmap(cache_dir / SHARD_PATTERN.format(shard_start // IMAGES_PER_SHARD),
+                                              mode='w+', dtype=np.uint8, shape=(len(shard_files), imgsz, imgsz, 3))
+            results = pool.map(lambda f: _resize_image(f, imgsz), shard_files)
+            for j, (im, (h0, w0)) in enumerate(TQDM(results, total=len(shard_files), desc=f"Letterbox cache {cache_dir.name}")):
+                h, w = im.shape[:2]
+                shard[j, :h, :w] = im if im.ndim == 3 else im[..., None]
+                shapes[shard_start + j] = (h0, w0, h, w)
+            shard.flush()
+            del shard
+
+    np.save(cache_dir / SHAPES_FILENAME, shapes)
+    np.save(cache_dir / STATS_FILENAME, stats)
+    cache_fingerprint = fingerprint(im_files, stats, imgsz)
+    # meta.json is written last: a directory without it is an unfinished build
+    with open(cache_dir / META_FILENAME, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'imgsz': imgsz, 'fingerprint': cache_fingerprint, 'files': im_files}, f)
+    return cache_fingerprint
+
+
+def is_cache_valid(im_files, cache_dir, imgsz):
+    """True if `cache_dir` holds exactly `im_files` at `imgsz` and no source image changed since it was built."""
+    meta_path = Path(cache_dir) / META_FILENAME
+    if not meta_path.exists():
+        return False
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != CACHE_VERSION or meta['imgsz'] != imgsz or meta['files'] != im_files:
+        return False
+    return meta['fingerprint'] == fingerprint(im_files, _file_stats(im_files), imgsz)
+
+
+class LetterboxCachedDataset(YOLODataset):
+    """
+    YOLODataset that reads pre-resized uint8 pixels from a letterbox cache instead of decoding JPEGs.
+    The cache is (re)built automatically the first time, or when its fingerprint no longer matches the images.
+    """
+
+    def __init__(self, *args, cache_root=CACHE_ROOT, **kwargs):
+        self.cache_root = cache_root
+        super().__init__(*args, **kwargs)
+
+    def get_labels(self):
+        labels = super().get_labels()  # Also drops images with corrupt labels from self.im_files
+        self.cache_dir = cache_dir_for(self.img_path, self.imgsz, self.cache_root)
+        if is_cache_valid(self.im_files, self.cache_dir, self.imgsz):
+            LOGGER.info(f"{self.prefix}Using letterbox cache {self.cache_dir}")
+        else:
+            LOGGER.info(f"{self.prefix}Letterbox cache missing or stale, building {self.cache_dir}...")
+            build_cache(self.im_files, self.cache_dir, self.imgsz)
+        self.cache_shapes = np.load(self.cache_dir / SHAPES_FILENAME)
+        self._shards = {}
+        return labels
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}  # Each DataLoader worker maps the shards itself
+        return state
+
+    def _cached_image(self, i):
+        shard_id, row = divmod(i, IMAGES_PER_SHARD)
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            shard = self._shards[shard_id] = np.load(self.cache_dir / SHARD_PATTERN.format(shard_id), mmap_mode='r')
+        h0, w0, h, w = self.cache_shapes[i]
+        return np.ascontiguousarray(shard[row, :h, :w]), (int(h0), int(w0))
+
+    def load_image(self, i, rect_mode=True):
+        """Same contract as BaseDataset.load_image, served from the cache."""
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im, (h0, w0) = self._cached_image(i)
+        if not rect_mode and im.shape[:2] != (self.imgsz, self.imgsz):  # stretch to square imgsz
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+
+        # Add to buffer if training with augmentations
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != 'ram':
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+
+        return im, (h0, w0), im.shape[:2]
+
+
+class LetterboxCacheTrainer(DetectionTrainer):
+    """DetectionTrainer that trains and validates on letterbox-cached images. Use with model.train(trainer=...)."""
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        gs = max(int(unwrap_model(self.model).stride.max() if self.model else 0), 32)
+        return LetterboxCachedDataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == 'train',
+            hyp=self.args,
+            rect=self.args.rect or mode == 'val',
+            cache=None,  # The letterbox cache replaces Ultralytics' own RAM/disk image cache
+            single_cls=self.args.single_cls or False,
+            stride=gs,
+            pad=0.0 if mode == 'train' else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            fraction=self.args.fraction if mode == 'train' else 1.0,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-build the letterbox cache of a dataset before training.")
+    parser.add_argument('data', help="Dataset yaml, e.g. oid_ingredients.yaml")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--splits', nargs='+', default=['train', 'val'])
+    args = parser.parse_args()
+
+    # Same dataset construction as training, so the cached image list matches exactly
+    data = check_det_dataset(args.data)
+    cfg = get_cfg(overrides={'imgsz': args.imgsz})
+    for split in args.splits:
+        if not data.get(split):
+            continue
+        dataset = LetterboxCachedDataset(img_path=data[split], imgsz=args.imgsz, augment=False, hyp=cfg,
+                                         prefix=colorstr(f"{split}: "), data=data)
+        print(f"✅ {split}: {len(dataset)} images cached in {dataset.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import errno
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# --- Configuration ---
+# 'hardlink' and 'reflink' share the data blocks of the source file, 'symlink' points at it, 'copy' duplicates it.
+# NOTE: Hardlinked/symlinked images are the SAME file as the source; never edit them in place.
+MATERIALIZE_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+DEFAULT_MODE = 'hardlink'
+MAX_WORKERS = 8
+MAX_PENDING_PER_WORKER = 64  # Bounds the submit queue so streaming producers cannot run ahead forever
+
+# Errors that mean "this link type is impossible here" and should fall back to a plain copy
+_CROSS_DEVICE_ERRNOS = {errno.EXDEV}
+_REFLINK_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EBADF}
+
+# ioctl request number of FICLONE on Linux (copy-on-write clone, supported by btrfs/XFS)
+_FICLONE = 0x40049409
+
+
+def _remove_existing(dst):
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOSYS, "reflink is not supported on this platform")
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.unlink(dst)
+            raise
+
+
+def is_up_to_date(src, dst, mode=DEFAULT_MODE):
+    """True if `dst` already holds `src` (same inode for hardlinks, same target for symlinks, same size/mtime for copies)."""
+    try:
+        if mode == 'symlink':
+            return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+        if os.path.samefile(src, dst):
+            return True
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    # A copy (or a link that fell back to one) is current if it is at least as new as the source
+    return src_stat.st_size == dst_stat.st_size and dst_stat.st_mtime >= src_stat.st_mtime
+
+
+def write_text_if_changed(path, text):
+    """
+    Writes `text` to `path` only if the content differs. Returns True if the file was written.
+    The write goes through a temp file + rename, so a hardlinked copy of the old file is never modified.
+    """
+    path = Path(path)
+    try:
+        with open(path, 'r') as f:
+            if f.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+def materialize_file(src, dst, mode=DEFAULT_MODE, incremental=False):
+    """
+    Places `src` at `dst` using the requested mode, falling back to a copy when the
+    link cannot cross filesystems. Returns (bytes_written, mode_used);
+    mode_used is 'unchanged' when `incremental` is set and `dst` is already current.
+    """
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(f"Unknown materialize mode '{mode}'. Choose from {MATERIALIZE_MODES}.")
+
+    if incremental and is_up_to_date(src, dst, mode):
+        return 0, 'unchanged'
+
+    _remove_existing(dst)
+
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return 0, mode
+        if mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+            return 0, mode
+        if mode == 'reflink':
+            _reflink(src, dst)
+            return 0, mode
+    except OSError as e:
+        allowed = _REFLINK_UNSUPPORTED_ERRNOS if mode == 'reflink' else _CROSS_DEVICE_ERRNOS
+        if e.errno not in allowed:
+            raise
+
+    shutil.copy(src, dst)
+    return os.path.getsize(dst), 'copy'
+
+
+class Materializer:
+    """
+    Materializes files on a bounded thread pool and tracks how many bytes were actually written.
+    Use as a context manager; leaving the block waits for every pending file and re-raises the first error.
+    With incremental=True, destinations that already hold their source are left alone.
+    """
+
+    def __init__(self, mode=DEFAULT_MODE, max_workers=MAX_WORKERS, incremental=False):
+        if mode not in MATERIALIZE_MODES:
+            raise ValueError(f"Unknown materialize mode '{mode}'. Choose from {MATERIALIZE_MODES}.")
+        self.mode = mode
+        self.incremental = incremental
+        self.files = 0
+        self.unchanged = 0
+        self.bytes_written = 0
+        self.fallback_copies = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers * MAX_PENDING_PER_WORKER)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._error = None
+
+    def _run(self, src, dst):
+        try:
+            written, mode_used = materialize_file(src, dst, self.mode, self.incremental)
+            with self._lock:
+                if mode_used == 'unchanged':
+                    self.unchanged += 1
+                    return
+                self.files += 1
+                self.bytes_written += written
+                if mode_used != self.mode:
+                    self.fallback_copies += 1
+        except Exception as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+        finally:
+            self._slots.release()
+
+    def submit(self, src, dst):
+        """Queues one file; blocks while the pool already has its maximum of pending files."""
+        if self._error is not None:
+            raise self._error
+        self._slots.acquire()
+        future = self._pool.submit(self._run, src, dst)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def flush(self):
+        """Waits until every file submitted so far is in place."""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._pool.shutdown(wait=True)
+        if exc_type is None and self._error is not None:
+            raise self._error
+        return False
+
+    def report(self):
+        fallback = f", {self.fallback_copies} fell back to copy" if self.fallback_copies else ""
+        unchanged = f", {self.unchanged} already up to date" if self.unchanged else ""
+        return (f"{self.files} files materialized ({self.mode}{fallback}){unchanged}, "
+                f"{self.bytes_written / 1024 ** 2:.1f} MB written")
+
+
+def materialize_tree(src_root, dst_root, mode=DEFAULT_MODE, max_workers=MAX_WORKERS, incremental=False, prune=False):
+    """
+    Recreates the directory tree of `src_root` under `dst_root`, materializing every file. Returns the Materializer.
+    With prune=True, files under `dst_root` that no longer exist in `src_root` are deleted (a one-way sync).
+    """
+    src_root, dst_root = Path(src_root), Path(dst_root)
+    with Materializer(mode, max_workers, incremental) as materializer:
+        for dirpath, _, filenames in os.walk(src_root):
+            target_dir = dst_root / Path(dirpath).relative_to(src_root)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            for filename in filenames:
+                materializer.submit(os.path.join(dirpath, filename), target_dir / filename)
+
+    if prune:
+        for dirpath, _, filenames in os.walk(dst_root):
+            source_dir = src_root / Path(dirpath).relative_to(dst_root)
+            for filename in filenames:
+                if not os.path.lexists(source_dir / filename):
+                    os.unlink(os.path.join(dirpath, filename))
+    return materializer
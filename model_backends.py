@@ -0,0 +1,212 @@
+import json
+import argparse
+from pathlib import Path
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+# --- Configuration ---
+# 'pytorch' runs best.pt as trained; 'onnx' (ONNX Runtime) and 'openvino' (OpenVINO IR) run an exported
+# copy of the same graph with CPU-optimized kernels. Ultralytics loads all three through the same YOLO() API,
+# so predict()/track() calls and their Results are unchanged.
+# 'openvino-int8' is the INT8-quantized OpenVINO model; it is built and accuracy-gated by quantize.py, never here.
+BACKENDS = ('pytorch', 'onnx', 'openvino', 'openvino-int8')
+EXPORT_BACKENDS = ('onnx', 'openvino')
+DEFAULT_BACKEND = 'pytorch'
+QUANTIZATION_REPORT = 'quantization.json'  # Written by quantize.py into the INT8 model once it passed the gate
+EXPORT_IMGSZ = 640
+# Dynamic axes let one exported model serve any batch size (micro-batches, batch mode) and input shape
+EXPORT_DYNAMIC = True
+# OpenVINO runs in bf16 by default on CPUs with AMX / AVX512-BF16, which shifts scores and flips close classes.
+# f32 keeps its detections identical to PyTorch; set to None to accept bf16 for extra speed.
+OPENVINO_PRECISION = 'f32'
+
+# Parity check: every PyTorch detection must be matched by the exported model (same class, IoU and
+# confidence within these tolerances), and the exported model may not add detections of its own
+PARITY_IOU = 0.9
+PARITY_CONF_TOLERANCE = 0.02
+PARITY_SAMPLE_SIZE = 50
+PARITY_CONF = 0.25
+
+
+def exported_path(pt_path, backend):
+    """Where Ultralytics writes the export of `pt_path` (next to the weights)."""
+    pt_path = Path(pt_path)
+    if backend == 'onnx':
+        return pt_path.with_suffix('.onnx')
+    if backend == 'openvino':
+        return pt_path.parent / f"{pt_path.stem}_openvino_model"
+    if backend == 'openvino-int8':
+        return pt_path.parent / f"{pt_path.stem}_int8_openvino_model"
+    return pt_path
+
+
+def export_model(pt_path, backend, imgsz=EXPORT_IMGSZ, force=False):
+    """
+    Exports best.pt to the backend's format unless an export newer than the weights already exists.
+    Returns the path to load with YOLO(). A retrained best.pt is newer than its export, so it is re-exported.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    target = exported_path(pt_path, backend)
+    if backend == 'pytorch':
+        return target
+    if backend == 'openvino-int8':
+        return published_int8_model(pt_path)
+    if not force and target.exists() and target.stat().st_mtime >= Path(pt_path).stat().st_mtime:
+        return target
+
+    print(f"--- Exporting {pt_path} to {backend} (imgsz {imgsz}) ---")
+    exported = YOLO(pt_path).export(format=backend, imgsz=imgsz, dynamic=EXPORT_DYNAMIC, half=False)
+    print(f"✅ Exported: {exported}")
+    return Path(exported)
+
+
+def published_int8_model(pt_path):
+    """The INT8 model quantize.py published for this best.pt. Raises if there is none or it predates best.pt."""
+    target = exported_path(pt_path, 'openvino-int8')
+    report_path = target / QUANTIZATION_REPORT
+    if not report_path.exists():
+        raise FileNotFoundError(f"No published INT8 model in {target}, run quantize.py first")
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+    if report['weights_mtime_ns'] != Path(pt_path).stat().st_mtime_ns:
+        raise FileNotFoundError(f"The INT8 model in {target} was quantized from an older {pt_path}, "
+                                f"run quantize.py again")
+    return target
+
+
+def _pin_openvino_precision(model, imgsz=EXPORT_IMGSZ):
+    """Recompiles the loaded OpenVINO graph with OPENVINO_PRECISION (Ultralytics compiles it with the default)."""
+    import openvino as ov
+
+    # The predictor (and its OpenVINO backend) is only created by the first predict call
+    model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    backend = model.predictor.model
+    backend.ov_compiled_model = ov.Core().compile_model(
+        backend.ov_model,
+        device_name=getattr(backend, 'device_name', 'AUTO'),
+        config={'PERFORMANCE_HINT': backend.inference_mode, 'INFERENCE_PRECISION_HINT': OPENVINO_PRECISION},
+    )
+
+
+def load_backend_model(pt_path, backend=DEFAULT_BACKEND):
+    """YOLO model for `backend`, exporting on first use."""
+    model = YOLO(str(export_model(pt_path, backend)), task='detect')
+    if backend in ('openvino', 'openvino-int8') and OPENVINO_PRECISION:
+        _pin_openvino_precision(model)
+    return model
+
+
+# ====================================================================
+# PARITY CHECK
+# ====================================================================
+
+def _pairwise_iou(a, b):
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_detections(reference, candidate, iou_threshold=PARITY_IOU, conf_tolerance=PARITY_CONF_TOLERANCE, conf=0.0):
+    """
+    Greedy one-to-one matching of two Results' boxes (same class, highest IoU first).
+    Returns (matched, missing from candidate, extra in candidate, max confidence difference of the matches).
+    Unmatched boxes scoring within conf_tolerance of the `conf` threshold are not counted: rounding alone
+    can move those to the other side of the threshold.
+    """
+    ref_boxes, cand_boxes = reference.boxes.xyxy.cpu().numpy(), candidate.boxes.xyxy.cpu().numpy()
+    ref_cls, cand_cls = reference.boxes.cls.cpu().numpy(), candidate.boxes.cls.cpu().numpy()
+    ref_conf, cand_conf = reference.boxes.conf.cpu().numpy(), candidate.boxes.conf.cpu().numpy()
+    ref_used, cand_used = np.zeros(len(ref_boxes), dtype=bool), np.zeros(len(cand_boxes), dtype=bool)
+    matched, max_conf_diff = 0, 0.0
+    iou = _pairwise_iou(ref_boxes, cand_boxes)
+    valid = (ref_cls[:, None] == cand_cls[None, :]) & (iou >= iou_threshold) \
+        & (np.abs(ref_conf[:, None] - cand_conf[None, :]) <= conf_tolerance)
+    iou = np.where(valid, iou, -1)
+
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < 0:
+            break  # Only invalid pairs are left
+        if ref_used[i] or cand_used[j]:
+            continue
+        ref_used[i] = cand_used[j] = True
+        matched += 1
+        max_conf_diff = max(max_conf_diff, float(abs(ref_conf[i] - cand_conf[j])))
+
+    missing = int((~ref_used & (ref_conf >= conf + conf_tolerance)).sum())
+    extra = int((~cand_used & (cand_conf >= conf + conf_tolerance)).sum())
+    return matched, missing, extra, max_conf_diff
+
+
+def parity_check(pt_path, backend, images, imgsz=EXPORT_IMGSZ, conf=PARITY_CONF):
+    """Runs PyTorch and `backend` on the same images and compares their detections. Returns True on parity."""
+    reference_model = YOLO(pt_path)
+    candidate_model = load_backend_model(pt_path, backend)
+
+    totals = {'matched': 0, 'missing': 0, 'extra': 0}
+    max_conf_diff = 0.0
+    mismatched_images = []
+    for image_path in images:
+        image = cv2.imread(str(image_path))
+        if image is None:
+            print(f"⚠️  Skipping unreadable image {image_path}")
+            continue
+        reference = reference_model.predict(image, imgsz=imgsz, conf=conf, verbose=False)[0]
+        candidate = candidate_model.predict(image, imgsz=imgsz, conf=conf, verbose=False)[0]
+        matched, missing, extra, conf_diff = match_detections(reference, candidate, conf=conf)
+        totals['matched'] += matched
+        totals['missing'] += missing
+        totals['extra'] += extra
+        max_conf_diff = max(max_conf_diff, conf_diff)
+        if missing or extra:
+            mismatched_images.append((str(image_path), missing, extra))
+
+    print(f"\n--- Parity {backend} vs pytorch on {len(images)} images ---")
+    print(f"Detections: {totals['matched']} matched, {totals['missing']} missing, {totals['extra']} extra "
+          f"(IoU >= {PARITY_IOU}, conf within {PARITY_CONF_TOLERANCE}); max conf difference {max_conf_diff:.4f}")
+    for image, missing, extra in mismatched_images[:10]:
+        print(f"⚠️  {image}: {missing} missing, {extra} extra")
+    if mismatched_images:
+        print(f"⚠️  {len(mismatched_images)} images differ")
+        return False
+    print(f"✅ {backend} reproduces the PyTorch detections")
+    return True
+
+
+def main():
+    from detector import CUSTOM_MODEL_PATH, iter_image_paths
+
+    parser = argparse.ArgumentParser(description="Export the detector for CPU runtimes and check parity with PyTorch.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help="Export best.pt (skipped if an up-to-date export exists)")
+    export.add_argument('--backend', choices=EXPORT_BACKENDS, default='onnx')
+    export.add_argument('--force', action='store_true')
+
+    parity = subparsers.add_parser('parity', help="Compare an exported backend with PyTorch on sample images")
+    parity.add_argument('sources', nargs='+', help="Directories, glob patterns, .txt file lists or image paths")
+    parity.add_argument('--backend', choices=EXPORT_BACKENDS, default='onnx')
+    parity.add_argument('--samples', type=int, default=PARITY_SAMPLE_SIZE)
+    parity.add_argument('--conf', type=float, default=PARITY_CONF)
+
+    for subparser in (export, parity):
+        subparser.add_argument('--model', default=CUSTOM_MODEL_PATH)
+        subparser.add_argument('--imgsz', type=int, default=EXPORT_IMGSZ)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_model(args.model, args.backend, args.imgsz, force=args.force)
+    else:
+        images = list(iter_image_paths(args.sources))[:args.samples]
+        export_model(args.model, args.backend, args.imgsz)
+        if not parity_check(args.model, args.backend, images, args.imgsz, args.conf):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
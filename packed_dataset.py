@@ -0,0 +1,206 @@
+import os
+import json
+import argparse
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yaml
+from PIL import Image
+from tqdm import tqdm
+from annotation_index import parse_label_file
+from file_catalog import ImageCatalog
+
+# --- Configuration ---
+# A packed split is a handful of large shard files holding the encoded image bytes back to back,
+# plus two memory-mapped arrays: one index row per image and one label row per box.
+SHARD_SIZE_BYTES = 1024 ** 3  # Start a new shard after ~1 GiB of image data
+READ_WORKERS = 16  # Parallel small-file reads while packing (helps a lot on network drives)
+READ_CHUNK = 256  # Images read ahead per batch, bounds the memory used while packing
+SPLITS = ['train', 'val', 'test']
+
+SHARD_PATTERN = 'shard_{:05d}.bin'
+INDEX_FILENAME = 'index.npy'
+LABELS_FILENAME = 'labels.npy'
+FILES_FILENAME = 'files.json'  # Original image names, in index order (for logs, plots and unpacking)
+
+INDEX_DTYPE = np.dtype([
+    ('shard', np.uint32),
+    ('offset', np.uint64),
+    ('length', np.uint64),
+    ('height', np.uint32),
+    ('width', np.uint32),
+    ('label_start', np.uint64),
+    ('label_count', np.uint32),
+])
+LABEL_DTYPE = np.float32  # Rows of (class_id, x, y, w, h), normalized xywh like the .txt files
+
+_EXIF_ORIENTATION = 0x0112
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}  # EXIF orientations that swap width and height
+
+
+def image_size(image_bytes):
+    """(height, width) of an encoded image as it will look after decoding (EXIF rotation applied)."""
+    with Image.open(BytesIO(image_bytes)) as im:
+        width, height = im.size
+        if im.getexif().get(_EXIF_ORIENTATION) in _ROTATED_ORIENTATIONS:
+            width, height = height, width
+    return height, width
+
+
+def _read_sample(image_path, label_path):
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    rows = parse_label_file(label_path) if os.path.exists(label_path) else []
+    return image_bytes, rows
+
+
+def pack_split(split_dir, out_dir, shard_size=SHARD_SIZE_BYTES, workers=READ_WORKERS):
+    """
+    Packs one YOLO split (images/ + labels/) into shard files and memory-mappable index/label arrays.
+    Images without a label file are packed as backgrounds. Returns the number of images packed.
+    """
+    split_dir, out_dir = Path(split_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob('shard_*.bin'):
+        stale.unlink()
+
+    catalog = ImageCatalog(split_dir / 'images')
+    stems = sorted(catalog.stems())
+    index = np.zeros(len(stems), dtype=INDEX_DTYPE)
+    labels = []
+    files = []
+    label_start = 0
+
+    shard_id, shard_offset = 0, 0
+    shard_file = open(out_dir / SHARD_PATTERN.format(shard_id), 'wb')
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for chunk_start in tqdm(range(0, len(stems), READ_CHUNK), desc=f"Packing {split_dir.name}"):
+                chunk = stems[chunk_start:chunk_start + READ_CHUNK]
+                samples = pool.map(_read_sample, [catalog.get(stem) for stem in chunk],
+                                   [split_dir / 'labels' / f"{stem}.txt" for stem in chunk])
+
+                for i, stem, (image_bytes, rows) in zip(range(chunk_start, chunk_start + len(chunk)), chunk, samples):
+                    # Roll over to a new shard once the current one is full
+                    if shard_offset and shard_offset + len(image_bytes) > shard_size:
+                        shard_file.close()
+                        shard_id, shard_offset = shard_id + 1, 0
+                        shard_file = open(out_dir / SHARD_PATTERN.format(shard_id), 'wb')
+
+                    shard_file.write(image_bytes)
+                    height, width = image_size(image_bytes)
+                    index[i] = (shard_id, shard_offset, len(image_bytes), height, width, label_start, len(rows))
+                    shard_offset += len(image_bytes)
+                    label_start += len(rows)
+                    labels.extend(rows)
+                    files.append(catalog.get(stem).name)
+    finally:
+        shard_file.close()
+
+    label_array = np.array(labels, dtype=LABEL_DTYPE).reshape(-1, 5)
+    np.save(out_dir / LABELS_FILENAME, label_array)
+    with open(out_dir / FILES_FILENAME, 'w') as f:
+        json.dump(files, f)
+    # The index is written last: a split without one is an interrupted pack
+    np.save(out_dir / INDEX_FILENAME, index)
+    return len(stems)
+
+
+def pack_dataset(dataset_root, out_root, splits=SPLITS, shard_size=SHARD_SIZE_BYTES):
+    """Packs every split of a YOLO dataset and writes a data.yaml for the packed copy. Returns its path."""
+    dataset_root, out_root = Path(dataset_root), Path(out_root)
+    with open(dataset_root / 'data.yaml', 'r') as f:
+        source_yaml = yaml.safe_load(f)
+
+    packed_splits = []
+    for split in splits:
+        if not (dataset_root / split / 'images').exists():
+            continue
+        count = pack_split(dataset_root / split, out_root / split, shard_size)
+        shards = len(list((out_root / split).glob('shard_*.bin')))
+        print(f"✅ {split}: {count} images packed into {shards} shard(s)")
+        packed_splits.append(split)
+
+    # Split entries point at the packed directories; only packed_loader.py knows how to read them
+    data = {'path': out_root.resolve().as_posix(), **{split: split for split in packed_splits},
+            'nc': source_yaml['nc'], 'names': source_yaml['names'], 'packed': True}
+    yaml_path = out_root / 'data.yaml'
+    with open(yaml_path, 'w') as f:
+        f.write(f"# Packed copy of {dataset_root} (generated by packed_dataset.py). Train with packed_loader.py.\n")
+        yaml.safe_dump(data, f, sort_keys=False)
+    return yaml_path
+
+
+class PackedSplit:
+    """
+    Read access to one packed split. The index, labels and shards are memory-mapped lazily,
+    so the object can be pickled into DataLoader worker processes (each worker maps its own view).
+    """
+
+    def __init__(self, split_dir):
+        self.split_dir = Path(split_dir)
+        if not (self.split_dir / INDEX_FILENAME).exists():
+            raise FileNotFoundError(f"{self.split_dir} is not a packed split (missing {INDEX_FILENAME})")
+        with open(self.split_dir / FILES_FILENAME, 'r') as f:
+            self.files = json.load(f)
+        self._index = None
+        self._labels = None
+        self._shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_index=None, _labels=None, _shards={})
+        return state
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = np.load(self.split_dir / INDEX_FILENAME, mmap_mode='r')
+        return self._index
+
+    @property
+    def labels(self):
+        if self._labels is None:
+            self._labels = np.load(self.split_dir / LABELS_FILENAME, mmap_mode='r')
+        return self._labels
+
+    def __len__(self):
+        return len(self.index)
+
+    def image_bytes(self, i):
+        """Encoded bytes of image i, sliced straight out of its shard."""
+        record = self.index[i]
+        shard_id = int(record['shard'])
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            shard = self._shards[shard_id] = np.memmap(self.split_dir / SHARD_PATTERN.format(shard_id),
+                                                       dtype=np.uint8, mode='r')
+        offset = int(record['offset'])
+        return shard[offset:offset + int(record['length'])]
+
+    def image_labels(self, i):
+        """(class_id, x, y, w, h) rows of image i."""
+        record = self.index[i]
+        start = int(record['label_start'])
+        return self.labels[start:start + int(record['label_count'])]
+
+    def shape(self, i):
+        record = self.index[i]
+        return int(record['height']), int(record['width'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a YOLO dataset into memory-mapped shard files.")
+    parser.add_argument('dataset_root', type=Path, help="Dataset with data.yaml and <split>/images, <split>/labels")
+    parser.add_argument('out_root', type=Path, help="Output directory for the packed dataset")
+    parser.add_argument('--splits', nargs='+', default=SPLITS)
+    parser.add_argument('--shard-size-mb', type=int, default=SHARD_SIZE_BYTES // 1024 ** 2)
+    args = parser.parse_args()
+
+    yaml_path = pack_dataset(args.dataset_root, args.out_root, args.splits, args.shard_size_mb * 1024 ** 2)
+    print(f"\n💡 Train on it with PACKED_DATA_YAML = '{yaml_path.as_posix()}' in train.py")
+
+
+if __name__ == "__main__":
+    main()
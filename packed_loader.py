@@ -0,0 +1,120 @@
+import math
+from pathlib import Path
+import cv2
+import numpy as np
+import psutil
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import LOGGER, colorstr
+from ultralytics.utils.torch_utils import unwrap_model
+from packed_dataset import PackedSplit
+
+
+class PackedYOLODataset(YOLODataset):
+    """
+    YOLODataset that reads images and labels from a split packed by packed_dataset.py
+    instead of opening one .jpg and one .txt per sample. Augmentations and batching are unchanged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # The .npy disk cache lives next to image files, which a packed split does not have
+        if kwargs.get('cache') == 'disk':
+            LOGGER.warning("cache='disk' is not supported for packed datasets, using cache='ram' instead")
+            kwargs['cache'] = 'ram'
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path):
+        """The 'files' of a packed split are its original image names (only used for logs and plots)."""
+        self.packed = PackedSplit(img_path)
+        im_files = [str(Path(img_path) / 'images' / name) for name in self.packed.files]
+        if self.fraction < 1:
+            im_files = im_files[: round(len(im_files) * self.fraction)]
+        return im_files
+
+    def get_labels(self):
+        """Builds the label dicts from the memory-mapped index and label block (no label files, no .cache)."""
+        self.label_files = []
+        labels = []
+        for i, im_file in enumerate(self.im_files):
+            rows = np.asarray(self.packed.image_labels(i), dtype=np.float32)
+            labels.append({
+                'im_file': im_file,
+                'shape': self.packed.shape(i),
+                'cls': rows[:, 0:1].copy(),
+                'bboxes': rows[:, 1:5].copy(),
+                'segments': [],
+                'keypoints': None,
+                'normalized': True,
+                'bbox_format': 'xywh',
+            })
+        boxes = sum(len(lb['cls']) for lb in labels)
+        LOGGER.info(f"{self.prefix}Packed split {self.packed.split_dir}: {len(labels)} images, {boxes} boxes")
+        return labels
+
+    def check_cache_ram(self, safety_margin=0.5):
+        """Same check as BaseDataset, but the decoded sizes come from the packed index instead of sample reads."""
+        index = self.packed.index[:self.ni]
+        ratio = self.imgsz / np.maximum(index['height'], index['width']).astype(np.float64)
+        mem_required = float((index['height'] * index['width'] * self.channels * ratio ** 2).sum()) * (1 + safety_margin)
+        mem = psutil.virtual_memory()
+        if mem_required > mem.available:
+            self.cache = None
+            LOGGER.warning(f"{self.prefix}{mem_required / (1 << 30):.1f}GB RAM required to cache images, "
+                           f"only {mem.available / (1 << 30):.1f}GB available, not caching images")
+            return False
+        return True
+
+    def load_image(self, i, rect_mode=True):
+        """Same as BaseDataset.load_image, but decodes the image from its shard slice."""
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im = cv2.imdecode(np.asarray(self.packed.image_bytes(i)), self.cv2_flag)  # BGR
+        if im is None:
+            raise FileNotFoundError(f"Image could not be decoded from packed split: {self.im_files[i]}")
+
+        h0, w0 = im.shape[:2]  # orig hw
+        if rect_mode:  # resize long side to imgsz while maintaining aspect ratio
+            r = self.imgsz / max(h0, w0)
+            if r != 1:
+                w, h = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+                im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h0 == w0 == self.imgsz):  # resize by stretching image to square imgsz
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        if im.ndim == 2:
+            im = im[..., None]
+
+        # Add to buffer if training with augmentations
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != 'ram':
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+
+        return im, (h0, w0), im.shape[:2]
+
+
+class PackedDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer whose train/val datasets come from packed splits. Use with model.train(trainer=...)."""
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        gs = max(int(unwrap_model(self.model).stride.max() if self.model else 0), 32)
+        return PackedYOLODataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == 'train',
+            hyp=self.args,
+            rect=self.args.rect or mode == 'val',
+            cache=self.args.cache or None,
+            single_cls=self.args.single_cls or False,
+            stride=gs,
+            pad=0.0 if mode == 'train' else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            fraction=self.args.fraction if mode == 'train' else 1.0,
+        )
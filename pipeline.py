@@ -0,0 +1,245 @@
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from collections import defaultdict
+
+import rename
+import discard
+import downsampling
+from annotation_index import load_annotation_index, class_counts, load_exclusions, drop_stems
+from file_catalog import ImageCatalog
+from materialize import Materializer, materialize_tree, write_text_if_changed
+
+# ====================================================================
+# 1. CONFIGURATION
+# ====================================================================
+
+# Pipeline bookkeeping (content hashes, stage fingerprints, per-file manifests)
+STATE_DIR = Path('./.pipeline')
+HASH_CACHE_PATH = STATE_DIR / 'content_hashes.json'
+STATE_PATH = STATE_DIR / 'stages.json'
+MERGE_MANIFEST_PATH = STATE_DIR / 'merge_manifest.json'
+
+# Stage outputs: merge -> balance come from rename.py / discard.py, the downsample stage
+# writes a hardlinked copy of the balanced dataset so the balanced output stays intact
+MERGED_ROOT = rename.DEST_ROOT
+BALANCED_ROOT = discard.DEST_ROOT
+DOWNSAMPLED_ROOT = Path('./merged_final_data_downsampled')
+DOWNSAMPLE_SPLITS = ['train', 'val']
+
+STAGES = ['merge', 'balance', 'downsample']
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# ====================================================================
+# 2. FINGERPRINTING
+# ====================================================================
+
+def fingerprint(*parts):
+    """Stable sha256 of any JSON-serializable inputs."""
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _load_json(path, default):
+    if path.exists():
+        with open(path, 'r') as f:
+            return json.load(f)
+    return default
+
+
+def _save_json(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class ContentHasher:
+    """
+    sha256 of file contents, memoized by (size, mtime) so a file is only read again when it changes.
+    The memo is persisted, so reruns hash only new or modified source files.
+    """
+
+    def __init__(self, cache_path=HASH_CACHE_PATH):
+        self.cache_path = cache_path
+        self.cache = _load_json(cache_path, {})
+        self.hashed = 0
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        record = self.cache.get(path)
+        if record and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            return record[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self.hashed += 1
+        return digest
+
+    def save(self):
+        _save_json(self.cache_path, self.cache)
+
+
+# ====================================================================
+# 3. STAGES
+# ====================================================================
+
+def run_merge_stage(hasher, state, force=False):
+    """
+    Merges the source datasets into MERGED_ROOT, re-processing only the stems whose
+    label file, image or dataset remap table changed since the last run.
+    """
+    print("\n=== STAGE: merge (rename.py) ===")
+    remap_luts = {ds_name: rename.generate_remap_lut(ds_name) for ds_name in rename.DATASET_NAMES}
+    remap_fingerprints = {ds_name: fingerprint(lut.tolist()) for ds_name, lut in remap_luts.items()}
+
+    # 1. Collect every source file per merged stem (a stem can appear in several splits of one dataset)
+    contributors = defaultdict(list)  # {unique stem: [(ds_name, split, label_file, image_path)]}
+    for ds_name in rename.DATASET_NAMES:
+        for split, label_file, image_path in rename.iter_dataset_files(rename.SOURCE_ROOT, ds_name):
+            contributors[f"{ds_name}_{label_file.stem}"].append((ds_name, split, label_file, image_path))
+
+    # 2. Fingerprint each merged stem by the content of everything that feeds it
+    stem_fingerprints = {}
+    for stem, sources in contributors.items():
+        ds_name = sources[0][0]
+        stem_fingerprints[stem] = fingerprint(
+            remap_fingerprints[ds_name],
+            [(split, hasher.digest(label_file), hasher.digest(image_path), image_path.suffix)
+             for _, split, label_file, image_path in sources],
+        )
+    hasher.save()
+
+    stage_fp = fingerprint('merge', sorted(stem_fingerprints.items()), rename.TAXONOMY.master_names)
+    if not force and state.get('merge') == stage_fp and MERGED_ROOT.exists():
+        print(f"✓ Up to date ({len(contributors)} images, {hasher.hashed} files re-hashed)")
+        return stage_fp
+
+    manifest = {} if force or not MERGED_ROOT.exists() else _load_json(MERGE_MANIFEST_PATH, {})
+    changed = [stem for stem in contributors if manifest.get(stem) != stem_fingerprints[stem]]
+    removed = [stem for stem in manifest if stem not in contributors]
+    print(f"{len(changed)} images to (re)merge, {len(removed)} to remove, "
+          f"{len(contributors) - len(changed)} unchanged")
+
+    # 3. Drop the previous outputs of changed/removed stems (their split may have changed)
+    for split in rename.SPLITS:
+        (MERGED_ROOT / split / 'images').mkdir(parents=True, exist_ok=True)
+        (MERGED_ROOT / split / 'labels').mkdir(parents=True, exist_ok=True)
+        image_catalog = ImageCatalog(MERGED_ROOT / split / 'images')
+        for stem in changed + removed:
+            (MERGED_ROOT / split / 'labels' / f"{stem}.txt").unlink(missing_ok=True)
+            image_path = image_catalog.get(stem)
+            if image_path is not None:
+                image_path.unlink()
+
+    # 4. Stream only the changed stems through the normal merge step
+    written_stems = {}
+    with Materializer(rename.MATERIALIZE_MODE) as materializer:
+        for stem in changed:
+            for ds_name, split, label_file, image_path in contributors[stem]:
+                rename.merge_label_file(ds_name, split, label_file, image_path, remap_luts[ds_name],
+                                        written_stems, materializer, MERGED_ROOT)
+    print(f"   Images: {materializer.report()}")
+
+    rename.create_final_yaml_full(MERGED_ROOT, rename.MASTER_NAMES)
+    _save_json(MERGE_MANIFEST_PATH, stem_fingerprints)
+    return stage_fp
+
+
+def run_balance_stage(state, merge_fp, force=False):
+    """Rebuilds BALANCED_ROOT when the merged data or the MIN/MAX thresholds changed."""
+    print("\n=== STAGE: balance (discard.py) ===")
+    excluded = load_exclusions(MERGED_ROOT)
+    stage_fp = fingerprint('balance', merge_fp, discard.MIN_SAMPLES, discard.MAX_SAMPLES,
+                           discard.TAXONOMY.master_names, discard.MATERIALIZE_MODE, sorted(excluded))
+    if not force and state.get('balance') == stage_fp and BALANCED_ROOT.exists():
+        print("✓ Up to date")
+        return stage_fp
+
+    # SAMPLE_COUNTS in discard.py is a snapshot; recount from the merged data so new sources are included
+    counts = class_counts(drop_stems(load_annotation_index(MERGED_ROOT, splits=discard.SPLITS), excluded))
+    sample_counts = {master_id: counts.get(master_id, 0) for master_id in sorted(discard.MASTER_ID_TO_NAME)}
+
+    discard.balance_dataset(source_root=MERGED_ROOT, dest_root=BALANCED_ROOT, sample_counts=sample_counts)
+    return stage_fp
+
+
+def run_downsample_stage(state, balance_fp, force=False):
+    """Syncs a hardlinked copy of BALANCED_ROOT into DOWNSAMPLED_ROOT and downsamples it."""
+    print("\n=== STAGE: downsample (downsampling.py) ===")
+    stage_fp = fingerprint('downsample', balance_fp, downsampling.TARGET_MAX, downsampling.PROTECT_THRESHOLD)
+    if not force and state.get('downsample') == stage_fp and DOWNSAMPLED_ROOT.exists():
+        print("✓ Up to date")
+        return stage_fp
+
+    # 1. Relink the balanced splits (links already in place are kept, removed files come back)
+    for split in discard.SPLITS:
+        if (BALANCED_ROOT / split).exists():
+            materializer = materialize_tree(BALANCED_ROOT / split, DOWNSAMPLED_ROOT / split,
+                                            mode='hardlink', incremental=True, prune=True)
+            print(f"   {split}: {materializer.report()}")
+
+    with open(BALANCED_ROOT / 'data.yaml', 'r') as f:
+        yaml_content = f.read().replace(f"{BALANCED_ROOT.name}/", f"{DOWNSAMPLED_ROOT.name}/")
+    write_text_if_changed(DOWNSAMPLED_ROOT / 'data.yaml', yaml_content)
+
+    # 2. Downsample in place (deletions only unlink the links, the balanced dataset is untouched)
+    annotations = load_annotation_index(DOWNSAMPLED_ROOT, splits=DOWNSAMPLE_SPLITS)
+    for split in DOWNSAMPLE_SPLITS:
+        split_dir = DOWNSAMPLED_ROOT / split
+        if not split_dir.exists():
+            continue
+        stats, files_removed = downsampling.smart_downsample(
+            split_dir, annotations.filter(annotations['split'] == split), dry_run=False)
+        print(f"   {split}: {len(stats)} classes downsampled, {files_removed} images removed")
+    return stage_fp
+
+
+# ====================================================================
+# 4. RUNNER
+# ====================================================================
+
+def run_pipeline(force=()):
+    """Runs merge -> balance -> downsample, skipping every stage whose inputs are unchanged."""
+    state = _load_json(STATE_PATH, {})
+    hasher = ContentHasher()
+
+    # Forcing a stage also forces everything downstream of it
+    forced = set()
+    for stage in force:
+        forced.update(STAGES[STAGES.index(stage):])
+
+    merge_fp = run_merge_stage(hasher, state, force='merge' in forced)
+    state['merge'] = merge_fp
+    _save_json(STATE_PATH, state)
+
+    balance_fp = run_balance_stage(state, merge_fp, force='balance' in forced)
+    state['balance'] = balance_fp
+    _save_json(STATE_PATH, state)
+
+    downsample_fp = run_downsample_stage(state, balance_fp, force='downsample' in forced)
+    state['downsample'] = downsample_fp
+    _save_json(STATE_PATH, state)
+
+    print(f"\n✅ Pipeline complete. Final dataset: {DOWNSAMPLED_ROOT}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental merge -> balance -> downsample dataset build.")
+    parser.add_argument('--force', nargs='+', choices=STAGES, default=[],
+                        help="Rebuild these stages (and everything after them) even if their inputs are unchanged")
+    args = parser.parse_args()
+    run_pipeline(force=args.force)
+
+
+if __name__ == "__main__":
+    main()
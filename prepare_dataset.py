@@ -1,7 +1,10 @@
-import fiftyone as fo
 import fiftyone.zoo as foz
 from ultralytics import settings
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from materialize import Materializer, write_text_if_changed
+from split_dataset import write_split_lists
 
 # --- CONFIGURATION ---
 # ⚠️ IMPORTANT: Replace this with YOUR comprehensive list of raw ingredients!
@@ -43,6 +46,82 @@ DATASET_NAME = "oid-raw-ingredients"
 # Set the directory where FiftyOne will store the raw dataset
 DATASET_ROOT = os.path.join(settings.get("datasets_dir"), DATASET_NAME)
 
+# --- EXPORT ---
+# Images are linked from the FiftyOne store instead of copied ('hardlink', 'symlink', 'reflink' or 'copy';
+# links fall back to a copy when the store is on another drive). Never edit exported images in place.
+EXPORT_LINK_MODE = 'hardlink'
+EXPORT_CHUNK_SIZE = 500  # Samples per work chunk; progress is recorded after every finished chunk
+EXPORT_WORKERS = 8
+EXPORT_SPLIT = 'val'  # Same layout as fo.types.YOLOv5Dataset: images/<split>/, labels/<split>/
+MANIFEST_FILENAME = '.export_manifest.jsonl'
+
+
+def to_yolo_lines(labels, boxes, class_to_index):
+    """FiftyOne detections ([x, y, w, h] top-left, normalized) -> YOLO lines; labels outside the classes are skipped."""
+    lines = []
+    for label, (x, y, w, h) in zip(labels or [], boxes or []):
+        class_id = class_to_index.get(label)
+        if class_id is None:
+            continue
+        lines.append(f"{class_id} {x + w / 2:.6f} {y + h / 2:.6f} {w:.6f} {h:.6f}\n")
+    return ''.join(lines)
+
+
+def export_chunk(chunk, export_dir, class_to_index, materializer):
+    """Writes the labels and links the images of one chunk of (sample_id, filepath, labels, boxes)."""
+    images_dir = os.path.join(export_dir, 'images', EXPORT_SPLIT)
+    labels_dir = os.path.join(export_dir, 'labels', EXPORT_SPLIT)
+    for sample_id, filepath, labels, boxes in chunk:
+        name = os.path.basename(filepath)
+        materializer.submit(filepath, os.path.join(images_dir, name))
+        label_path = os.path.join(labels_dir, os.path.splitext(name)[0] + '.txt')
+        write_text_if_changed(label_path, to_yolo_lines(labels, boxes, class_to_index))
+    return [sample_id for sample_id, _, _, _ in chunk]
+
+
+def export_yolo_resumable(dataset, export_dir, classes):
+    """
+    Exports `dataset` in the YOLOv5 layout in parallel chunks. Every finished chunk is appended to a
+    progress manifest, so a rerun after a crash only exports the samples that are not done yet.
+    """
+    os.makedirs(os.path.join(export_dir, 'images', EXPORT_SPLIT), exist_ok=True)
+    os.makedirs(os.path.join(export_dir, 'labels', EXPORT_SPLIT), exist_ok=True)
+    class_to_index = {name: index for index, name in enumerate(classes)}
+
+    # The manifest is only valid for the same class list (it decides the label indices)
+    manifest_path = os.path.join(export_dir, MANIFEST_FILENAME)
+    done = set()
+    write_header = True
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if entries and entries[0].get('classes') == classes:
+            write_header = False
+            for entry in entries[1:]:
+                done.update(entry.get('samples', ()))  # Older runs could append a repeated header
+        else:
+            os.remove(manifest_path)
+
+    # Pull every needed field in one query per field instead of iterating Sample objects
+    ids, filepaths, labels, boxes = dataset.values(
+        ['id', 'filepath', 'detections.detections.label', 'detections.detections.bounding_box'])
+    pending = [row for row in zip(ids, filepaths, labels, boxes) if row[0] not in done]
+    print(f"{len(done)} samples already exported, {len(pending)} to go")
+
+    chunks = [pending[i:i + EXPORT_CHUNK_SIZE] for i in range(0, len(pending), EXPORT_CHUNK_SIZE)]
+    exported = len(done)
+    with open(manifest_path, 'a') as manifest:
+        if write_header:  # New or just removed; a run that crashed before its first chunk already has one
+            manifest.write(json.dumps({'classes': classes}) + '\n')
+        with Materializer(EXPORT_LINK_MODE, incremental=True) as materializer, ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+            for finished in pool.map(lambda chunk: export_chunk(chunk, export_dir, class_to_index, materializer), chunks):
+                materializer.flush()  # The chunk's images are in place before it is marked done
+                manifest.write(json.dumps({'samples': finished}) + '\n')
+                manifest.flush()
+                exported += len(finished)
+                print(f"   {exported}/{len(ids)} samples exported")
+    print(f"   Images: {materializer.report()}")
+
 
 # 1. Download and Filter the Open Images Dataset
 print(f"Starting download and filtering for {len(TARGET_CLASSES)} classes...")
@@ -63,16 +142,20 @@ dataset = foz.load_zoo_dataset(
 EXPORT_DIR = os.path.join(os.getcwd(), "OID_YOLO_DATA")
 print(f"Exporting data to YOLO format in: {EXPORT_DIR}")
 
-dataset.export(
-    export_dir=EXPORT_DIR,
-    dataset_type=fo.types.YOLOv5Dataset,  
-    label_field="detections", 
-    classes=TARGET_CLASSES
-)
+export_yolo_resumable(dataset, EXPORT_DIR, TARGET_CLASSES)
 print("\n--- Dataset Preparation Complete ---")
 print(f"Data is ready for training in the '{EXPORT_DIR}' folder.")
 
-# 3. Save the class names and paths for the YAML file
+# 3. Split into train/val/test lists (stable per image, stratified by class, fixed-size val)
+# Training and validating on the same 'images' folder made every validation pass re-score the training set.
+print("Writing stratified train/val/test split lists...")
+split_lists = write_split_lists(
+    EXPORT_DIR,
+    os.path.join(EXPORT_DIR, 'images', EXPORT_SPLIT),
+    os.path.join(EXPORT_DIR, 'labels', EXPORT_SPLIT),
+)
+
+# 4. Save the class names and paths for the YAML file
 # Create a simplified YAML for Ultralytics
 yaml_content = f"""
 # Ultralytics YOLOv8 Dataset YAML for Raw Ingredients
@@ -80,10 +163,8 @@ yaml_content = f"""
 # Dataset Root
 path: {EXPORT_DIR}
 
-# Train/Val/Test data (assuming FiftyOne exported a single 'train' split)
-train: images
-val: images
-
+# Train/Val/Test image lists written by split_dataset.py
+""" + "".join(f"{split}: {split}.txt\n" for split in split_lists) + f"""
 # Number of classes
 nc: {len(TARGET_CLASSES)}
 
@@ -0,0 +1,151 @@
+import os
+import csv
+import json
+import shutil
+import argparse
+from pathlib import Path
+from ultralytics import YOLO
+from detector import CUSTOM_MODEL_PATH
+from file_catalog import IMAGE_EXTENSIONS
+from model_backends import EXPORT_IMGSZ, QUANTIZATION_REPORT, exported_path
+
+# --- Configuration ---
+# INT8 post-training quantization of best.pt (OpenVINO + NNCF), published only if it keeps its accuracy
+DATASET_ROOT = Path('FinalDataset')
+CALIBRATION_IMAGES = 300  # Calibration images drawn from DATASET_ROOT/val (NNCF recommends >= 300)
+EVAL_BATCH = 8
+
+# Gate: the INT8 model is rejected if it loses more than this many mAP points against the FP32 reference
+MAX_MAP50_DROP = 0.01
+MAX_MAP50_95_DROP = 0.01
+
+# The FP32 reference is the best.pt epoch in results.csv (the row best.pt was saved from). Those numbers were
+# measured on the training run's val split; if DATASET_ROOT/val is a different set, measure FP32 on it instead.
+MEASURE_FP32_REFERENCE = False
+MAP50_COLUMN = 'metrics/mAP50(B)'
+MAP50_95_COLUMN = 'metrics/mAP50-95(B)'
+
+
+# ====================================================================
+# 1. REFERENCE AND EVALUATION
+# ====================================================================
+
+def reference_metrics(pt_path):
+    """mAP50 / mAP50-95 of the epoch best.pt was saved from (Ultralytics keeps the best 0.1*mAP50 + 0.9*mAP50-95)."""
+    results_csv = Path(pt_path).parent.parent / 'results.csv'
+    with open(results_csv, 'r', newline='') as f:
+        # Older Ultralytics versions pad the header and values with spaces
+        rows = [{key.strip(): float(value) for key, value in row.items()} for row in csv.DictReader(f)]
+    if not rows:
+        raise ValueError(f"{results_csv} has no epochs")
+    best = max(rows, key=lambda row: 0.1 * row[MAP50_COLUMN] + 0.9 * row[MAP50_95_COLUMN])
+    print(f"FP32 reference: epoch {int(best['epoch'])} of {results_csv}")
+    return {'map50': best[MAP50_COLUMN], 'map50_95': best[MAP50_95_COLUMN]}
+
+
+def write_data_yaml(pt_path, dataset_root):
+    """
+    FinalDataset has no data.yaml of its own; writes one next to the weights for calibration and validation
+    (class names come from the model, so the label ids mean what the model was trained on).
+    """
+    names = YOLO(pt_path).names
+    yaml_path = Path(pt_path).parent / 'quantize_data.yaml'
+    lines = [f"path: {Path(dataset_root).resolve().as_posix()}\n", "train: train/images\n", "val: val/images\n",
+             f"nc: {len(names)}\n", "names:\n"]
+    lines += [f"  {class_id}: {json.dumps(name)}\n" for class_id, name in sorted(names.items())]
+    with open(yaml_path, 'w') as f:
+        f.writelines(lines)
+    return yaml_path
+
+
+def evaluate(model_path, data_yaml, imgsz):
+    metrics = YOLO(str(model_path), task='detect').val(data=str(data_yaml), split='val', imgsz=imgsz,
+                                                       batch=EVAL_BATCH, plots=False, verbose=False)
+    return {'map50': float(metrics.box.map50), 'map50_95': float(metrics.box.map)}
+
+
+# ====================================================================
+# 2. QUANTIZE -> EVALUATE -> PUBLISH OR REJECT
+# ====================================================================
+
+def quantize(pt_path=CUSTOM_MODEL_PATH, dataset_root=DATASET_ROOT, imgsz=EXPORT_IMGSZ,
+             calibration_images=CALIBRATION_IMAGES, max_map50_drop=MAX_MAP50_DROP,
+             max_map50_95_drop=MAX_MAP50_95_DROP, measure_reference=MEASURE_FP32_REFERENCE):
+    """
+    Calibrates an INT8 OpenVINO model on DATASET_ROOT/val, evaluates it and publishes it (detector.py
+    --backend openvino-int8) only if its mAP drop is within the limits. Returns True if published.
+    """
+    int8_dir = exported_path(pt_path, 'openvino-int8')
+    rejected_dir = int8_dir.with_name(int8_dir.name + '_rejected')
+
+    # 1. Unpublish the previous INT8 model: whatever happens next, a stale one must not stay loadable
+    (int8_dir / QUANTIZATION_REPORT).unlink(missing_ok=True)
+
+    # 2. Calibrate on a few hundred val images
+    data_yaml = write_data_yaml(pt_path, dataset_root)
+    val_images = sum(1 for p in (Path(dataset_root) / 'val' / 'images').iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    fraction = min(1.0, calibration_images / max(val_images, 1))
+    print(f"--- Calibrating INT8 on {min(calibration_images, val_images)} of {val_images} val images ---")
+    exported = Path(YOLO(pt_path).export(format='openvino', int8=True, data=str(data_yaml), fraction=fraction,
+                                         imgsz=imgsz, dynamic=True))
+    if exported.resolve() != int8_dir.resolve():
+        raise RuntimeError(f"Expected the INT8 export in {int8_dir}, got {exported}")
+
+    # 3. Evaluate on the full val split. Ultralytics' validator compiles OpenVINO with its default precision
+    # (bf16 on some CPUs), which can only make the measured INT8 accuracy more pessimistic than detector.py's.
+    reference = evaluate(pt_path, data_yaml, imgsz) if measure_reference else reference_metrics(pt_path)
+    quantized = evaluate(int8_dir, data_yaml, imgsz)
+    drops = {metric: reference[metric] - quantized[metric] for metric in reference}
+    limits = {'map50': max_map50_drop, 'map50_95': max_map50_95_drop}
+
+    print("\n--- INT8 vs FP32 ---")
+    for metric in reference:
+        status = "✅" if drops[metric] <= limits[metric] else "⚠️ "
+        print(f"{status} {metric}: {reference[metric]:.4f} -> {quantized[metric]:.4f} "
+              f"(drop {drops[metric]:+.4f}, limit {limits[metric]})")
+
+    # 4. Publish (the report marks the directory as loadable) or move the model aside for inspection
+    passed = all(drops[metric] <= limits[metric] for metric in reference)
+    if not passed:
+        shutil.rmtree(rejected_dir, ignore_errors=True)
+        os.replace(int8_dir, rejected_dir)
+        print(f"⚠️  Accuracy drop too large, INT8 model NOT published (kept in {rejected_dir})")
+        return False
+
+    report = {
+        'weights': str(pt_path),
+        'weights_mtime_ns': Path(pt_path).stat().st_mtime_ns,
+        'imgsz': imgsz,
+        'calibration_images': min(calibration_images, val_images),
+        'reference': reference,
+        'reference_source': 'measured' if measure_reference else 'results.csv',
+        'int8': quantized,
+        'limits': limits,
+    }
+    tmp_path = int8_dir / (QUANTIZATION_REPORT + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, int8_dir / QUANTIZATION_REPORT)
+    shutil.rmtree(rejected_dir, ignore_errors=True)
+    print(f"✅ INT8 model published: {int8_dir} (use detector.py --backend openvino-int8)")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8-quantize best.pt and publish it only if mAP holds up.")
+    parser.add_argument('--model', default=CUSTOM_MODEL_PATH)
+    parser.add_argument('--data', type=Path, default=DATASET_ROOT, help="Dataset root with val/images and val/labels")
+    parser.add_argument('--imgsz', type=int, default=EXPORT_IMGSZ)
+    parser.add_argument('--calibration-images', type=int, default=CALIBRATION_IMAGES)
+    parser.add_argument('--max-map50-drop', type=float, default=MAX_MAP50_DROP)
+    parser.add_argument('--max-map50-95-drop', type=float, default=MAX_MAP50_95_DROP)
+    parser.add_argument('--measure-reference', action='store_true', default=MEASURE_FP32_REFERENCE,
+                        help="Measure FP32 on the same val split instead of reading results.csv")
+    args = parser.parse_args()
+    if not quantize(args.model, args.data, args.imgsz, args.calibration_images, args.max_map50_drop,
+                    args.max_map50_95_drop, args.measure_reference):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import json
+import shutil
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+# --- Configuration ---
+# Removed files are renamed into TRASH_DIR/<run id>/ instead of being deleted. Keep TRASH_DIR on the same
+# drive as the dataset so every move is a rename (anything else falls back to a copy + delete).
+DEFAULT_TRASH_DIR = Path('FinalDataset_trash')
+JOURNAL_FILENAME = 'journal.jsonl'  # One line per moved file, written BEFORE the move
+META_FILENAME = 'run.json'  # Dataset root, description and status ('open', 'complete', 'undone')
+
+
+def _move(src, dst):
+    """Same-filesystem rename; copy + delete only if the trash lives on another drive."""
+    try:
+        os.replace(src, dst)
+    except OSError:
+        shutil.move(src, dst)
+
+
+def _write_json(path, data):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class TrashJournal:
+    """
+    One soft-delete run: files are moved (not copied) into the run's trash folder and every move is
+    journaled first, so a crashed or unwanted run can always be replayed in reverse with undo_run().
+    Use as a context manager; the run is marked 'complete' when the block exits without an error.
+    """
+
+    def __init__(self, dataset_root, trash_dir=DEFAULT_TRASH_DIR, description=''):
+        self.dataset_root = Path(dataset_root).resolve()
+        self.run_id = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self.run_dir = Path(trash_dir) / self.run_id
+        self.run_dir.mkdir(parents=True)
+        self.meta = {
+            'run_id': self.run_id,
+            'dataset_root': str(self.dataset_root),
+            'description': description,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'status': 'open',
+            'files': 0,
+        }
+        _write_json(self.run_dir / META_FILENAME, self.meta)
+        self._journal = open(self.run_dir / JOURNAL_FILENAME, 'a')
+
+    def remove(self, path):
+        """Moves one file of the dataset into the trash. Missing files are ignored; returns True if moved."""
+        path = Path(path)
+        if not os.path.lexists(path):
+            return False
+        # Resolve the folder only: a symlinked image (materialize 'symlink' mode) points outside the dataset,
+        # and the link itself is what gets trashed
+        relative = path.parent.resolve().relative_to(self.dataset_root) / path.name
+        target = self.run_dir / 'files' / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        # Journal first: after a crash the entry may point at a file that never moved, which undo skips
+        self._journal.write(json.dumps({'path': relative.as_posix()}) + '\n')
+        self._journal.flush()
+        _move(path, target)
+        self.meta['files'] += 1
+        return True
+
+    def close(self, status='complete'):
+        self._journal.close()
+        self.meta['status'] = status
+        _write_json(self.run_dir / META_FILENAME, self.meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close('complete' if exc_type is None else 'open')
+        return False
+
+
+def list_runs(trash_dir=DEFAULT_TRASH_DIR):
+    """Returns the metadata of every run in `trash_dir`, oldest first."""
+    trash_dir = Path(trash_dir)
+    if not trash_dir.exists():
+        return []
+    runs = []
+    for run_dir in sorted(trash_dir.iterdir()):
+        meta_path = run_dir / META_FILENAME
+        if meta_path.exists():
+            with open(meta_path, 'r') as f:
+                runs.append(json.load(f))
+    return runs
+
+
+def undo_run(run_id=None, trash_dir=DEFAULT_TRASH_DIR):
+    """
+    Replays a run's journal in reverse, renaming every file back to where it was.
+    Defaults to the newest run that has not been undone yet. Returns (run metadata, files restored).
+    """
+    pending = [run for run in list_runs(trash_dir) if run['status'] != 'undone']
+    if run_id is not None:
+        pending = [run for run in pending if run['run_id'] == run_id]
+    if not pending:
+        raise FileNotFoundError(f"No run to undo in {trash_dir}" + (f" with id {run_id}" if run_id else ""))
+
+    meta = pending[-1]
+    run_dir = Path(trash_dir) / meta['run_id']
+    dataset_root = Path(meta['dataset_root'])
+    with open(run_dir / JOURNAL_FILENAME, 'r') as f:
+        entries = [json.loads(line)['path'] for line in f if line.strip()]
+
+    restored = 0
+    for relative in reversed(entries):
+        source = run_dir / 'files' / relative
+        if not os.path.lexists(source):
+            continue
+        destination = dataset_root / relative
+        if os.path.lexists(destination):
+            print(f"⚠️  {destination} exists again, leaving the trashed copy in place")
+            continue
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        _move(source, destination)
+        restored += 1
+
+    meta['status'] = 'undone'
+    _write_json(run_dir / META_FILENAME, meta)
+    return meta, restored
+
+
+def purge_run(run_id, trash_dir=DEFAULT_TRASH_DIR):
+    """Permanently deletes a run's trashed files (frees the disk space; the run can no longer be undone)."""
+    run_dir = Path(trash_dir) / run_id
+    if not (run_dir / META_FILENAME).exists():
+        raise FileNotFoundError(f"Run {run_id} not found in {trash_dir}")
+    shutil.rmtree(run_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List, undo or purge journaled soft-delete runs.")
+    parser.add_argument('command', choices=['list', 'undo', 'purge'])
+    parser.add_argument('run_id', nargs='?', help="Run to undo/purge (undo defaults to the newest run)")
+    parser.add_argument('--trash-dir', type=Path, default=DEFAULT_TRASH_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        runs = list_runs(args.trash_dir)
+        if not runs:
+            print(f"No runs in {args.trash_dir}")
+        for run in runs:
+            print(f"{run['run_id']}  {run['status']:<9} {run['files']:>7} files  {run['description']}")
+    elif args.command == 'undo':
+        meta, restored = undo_run(args.run_id, args.trash_dir)
+        print(f"✅ Undid run {meta['run_id']}: {restored} files restored to {meta['dataset_root']}")
+    else:
+        if args.run_id is None:
+            parser.error("purge needs a run_id")
+        purge_run(args.run_id, args.trash_dir)
+        print(f"✅ Purged run {args.run_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import hashlib
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dataset_stats import load_split_arrays
+from file_catalog import ImageCatalog
+from materialize import write_text_if_changed
+
+# --- Configuration ---
+# Validation and test are FIXED-SIZE samples, so their cost per epoch stays the same as the dataset grows.
+VAL_SIZE = 1000
+TEST_SIZE = 500
+SPLIT_SEED = 'meal-plan-split-v1'  # Changing it reshuffles every assignment
+BACKGROUND_STRATUM = -1  # Images without any box
+
+
+def stem_hash(stem, seed=SPLIT_SEED):
+    """Stable position of an image in [0, 1): the same stem always lands in the same place, on any machine."""
+    digest = hashlib.sha1(f"{seed}:{stem}".encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def assign_strata(image_classes):
+    """
+    Stratum of every image = its rarest class (fewest images overall), so images carrying rare classes are
+    spread across the splits first. image_classes is a list of class-id arrays, one per image.
+    """
+    images_per_class = defaultdict(int)
+    for classes in image_classes:
+        for class_id in classes:
+            images_per_class[class_id] += 1
+    return np.array([min(classes, key=lambda c: (images_per_class[c], c)) if len(classes) else BACKGROUND_STRATUM
+                     for classes in image_classes], dtype=np.int64)
+
+
+def allocate_quota(stratum_sizes, total):
+    """Splits `total` across strata proportionally to their size (largest remainder, sums exactly to total)."""
+    sizes = np.asarray(stratum_sizes, dtype=np.float64)
+    if total <= 0 or sizes.sum() == 0:
+        return np.zeros(len(sizes), dtype=np.int64)
+    total = min(total, int(sizes.sum()))
+    exact = sizes * total / sizes.sum()
+    quota = np.floor(exact).astype(np.int64)
+    remainder = total - quota.sum()
+    order = np.lexsort((-sizes, -(exact - quota)))  # Largest remainder first, bigger strata win ties
+    quota[order[:remainder]] += 1
+    return quota
+
+
+def split_images(stems, image_classes, val_size=VAL_SIZE, test_size=TEST_SIZE, seed=SPLIT_SEED):
+    """
+    Returns {'train': [...], 'val': [...], 'test': [...]} stems.
+    Inside each stratum images are ranked by stable hash; the lowest hashes go to val, the next to test.
+    """
+    strata = assign_strata(image_classes)
+    hashes = np.array([stem_hash(stem, seed) for stem in stems])
+    stratum_ids, stratum_of_image = np.unique(strata, return_inverse=True)
+    stratum_sizes = np.bincount(stratum_of_image, minlength=len(stratum_ids))
+
+    val_quota = allocate_quota(stratum_sizes, val_size)
+    test_quota = allocate_quota(stratum_sizes - val_quota, test_size)
+
+    # Rank of each image inside its stratum by hash
+    order = np.lexsort((hashes, stratum_of_image))
+    starts = np.concatenate([[0], np.cumsum(stratum_sizes)[:-1]])
+    rank = np.empty(len(stems), dtype=np.int64)
+    rank[order] = np.arange(len(stems)) - np.repeat(starts, stratum_sizes)
+
+    in_val = rank < val_quota[stratum_of_image]
+    in_test = ~in_val & (rank < (val_quota + test_quota)[stratum_of_image])
+    stems = np.asarray(stems, dtype=object)
+    return {
+        'train': sorted(stems[~in_val & ~in_test].tolist()),
+        'val': sorted(stems[in_val].tolist()),
+        'test': sorted(stems[in_test].tolist()),
+    }
+
+
+def load_image_classes(images_dir, labels_dir):
+    """Returns (image catalog, sorted stems, class-id array per stem); images without a label file are backgrounds."""
+    catalog = ImageCatalog(images_dir)
+    # Threads, not processes: prepare_dataset.py runs this at import level, which spawned workers would re-run
+    with ThreadPoolExecutor() as executor:
+        label_files, labels, file_index, _, _ = load_split_arrays(labels_dir, executor=executor)
+
+    classes_by_stem = {}
+    class_ids = labels[:, 0].astype(np.int64)
+    boundaries = np.searchsorted(file_index, np.arange(len(label_files) + 1))
+    for i, label_file in enumerate(label_files):
+        classes_by_stem[Path(label_file).stem] = np.unique(class_ids[boundaries[i]:boundaries[i + 1]])
+
+    stems = sorted(catalog.stems())
+    empty = np.zeros(0, dtype=np.int64)
+    return catalog, stems, [classes_by_stem.get(stem, empty) for stem in stems]
+
+
+def labels_dir_for(images_dir):
+    """Ultralytics' rule: the labels live where the last 'images' path component is replaced by 'labels'."""
+    parts = list(Path(images_dir).parts)
+    position = len(parts) - 1 - parts[::-1].index('images')
+    parts[position] = 'labels'
+    return Path(*parts)
+
+
+def write_split_lists(dataset_root, images_dir, labels_dir, val_size=VAL_SIZE, test_size=TEST_SIZE):
+    """
+    Writes train.txt / val.txt / test.txt into dataset_root (entries relative to it, as Ultralytics expects).
+    Returns {split: list path} for the non-empty splits.
+    """
+    dataset_root = Path(dataset_root)
+    catalog, stems, image_classes = load_image_classes(images_dir, labels_dir)
+    splits = split_images(stems, image_classes, val_size, test_size)
+
+    all_classes = set().union(*map(set, image_classes)) if image_classes else set()
+    list_paths = {}
+    for split, split_stems in splits.items():
+        list_path = dataset_root / f"{split}.txt"
+        if not split_stems:
+            list_path.unlink(missing_ok=True)  # e.g. TEST_SIZE set to 0 after an earlier run
+            continue
+        lines = [f"./{os.path.relpath(catalog.get(stem), dataset_root).replace(os.sep, '/')}\n" for stem in split_stems]
+        write_text_if_changed(list_path, ''.join(lines))
+        list_paths[split] = list_path
+
+    # Report how well the class composition carried over
+    position = {stem: i for i, stem in enumerate(stems)}
+    for split, split_stems in splits.items():
+        covered = set()
+        for stem in split_stems:
+            covered.update(image_classes[position[stem]].tolist())
+        print(f"   {split:<5}: {len(split_stems):>7} images, {len(covered)}/{len(all_classes)} classes present")
+    return list_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stable, stratified train/val/test split lists for a YOLO image folder.")
+    parser.add_argument('dataset_root', type=Path, help="Where train.txt/val.txt/test.txt are written")
+    parser.add_argument('--images', type=Path, help="Images directory (default: <dataset_root>/images)")
+    parser.add_argument('--labels', type=Path, help="Labels directory (default: images path with images -> labels)")
+    parser.add_argument('--val-size', type=int, default=VAL_SIZE)
+    parser.add_argument('--test-size', type=int, default=TEST_SIZE)
+    args = parser.parse_args()
+
+    images_dir = args.images or args.dataset_root / 'images'
+    labels_dir = args.labels or labels_dir_for(images_dir)
+    list_paths = write_split_lists(args.dataset_root, images_dir, labels_dir, args.val_size, args.test_size)
+    print(f"✅ Split lists written: {', '.join(str(p) for p in list_paths.values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+from pathlib import Path
+from functools import lru_cache
+import numpy as np
+import yaml
+
+# --- Configuration ---
+TAXONOMY_PATH = Path(__file__).with_name('taxonomy.yaml')
+UNMAPPED = -1  # Lookup table value for ids that have no target class (the annotation is dropped)
+
+
+class Taxonomy:
+    """
+    The master class list, the final (trained) class list and every source dataset's remap table,
+    validated once and compiled into NumPy lookup tables so whole label arrays remap with one indexing op.
+    """
+
+    def __init__(self, master, final, sources):
+        self.master_names = list(master)
+        self.final_names = list(final)
+        self.sources = {ds_name: {int(k): v for k, v in table.items()} for ds_name, table in sources.items()}
+        self.validate()
+
+        self.master_index = {name: i for i, name in enumerate(self.master_names)}  # {name: master id}
+        self.final_index = {name: i for i, name in enumerate(self.final_names)}  # {name: final id}
+        self.master_to_final_lut = self.subset_lut(self.master_index[name] for name in self.final_names)
+        self.final_to_master = np.array([self.master_index[name] for name in self.final_names], dtype=np.int32)
+        self._source_luts = {}
+
+    def validate(self):
+        """Raises ValueError listing every problem (duplicates, unknown names, ordering)."""
+        problems = []
+        for label, names in (('master', self.master_names), ('final', self.final_names)):
+            duplicates = sorted({name for name in names if names.count(name) > 1})
+            if duplicates:
+                problems.append(f"duplicate {label} names: {duplicates}")
+
+        master = set(self.master_names)
+        unknown_final = [name for name in self.final_names if name not in master]
+        if unknown_final:
+            problems.append(f"final names not in master: {unknown_final}")
+        elif [n for n in self.master_names if n in set(self.final_names)] != self.final_names:
+            problems.append("final names must keep the master order (final ids are the surviving master ids, renumbered)")
+
+        for ds_name, table in self.sources.items():
+            unknown = sorted({name for name in table.values() if name not in master})
+            if unknown:
+                problems.append(f"{ds_name}: names not in master: {unknown}")
+            negative = [old_id for old_id in table if old_id < 0]
+            if negative:
+                problems.append(f"{ds_name}: negative class ids: {negative}")
+
+        if problems:
+            raise ValueError("Invalid taxonomy:\n  " + "\n  ".join(problems))
+
+    # --- Lookup tables ---
+
+    def source_lut(self, ds_name):
+        """int32 array: source class id -> master id (UNMAPPED for ids missing from the table)."""
+        lut = self._source_luts.get(ds_name)
+        if lut is None:
+            table = self.sources[ds_name]
+            lut = np.full(max(table) + 1, UNMAPPED, dtype=np.int32)
+            for old_id, name in table.items():
+                lut[old_id] = self.master_index[name]
+            self._source_luts[ds_name] = lut
+        return lut
+
+    def subset_lut(self, kept_master_ids):
+        """int32 array: master id -> contiguous new id for the kept ids (in master order), UNMAPPED otherwise."""
+        kept = np.unique(np.fromiter(kept_master_ids, dtype=np.int64))
+        lut = np.full(len(self.master_names), UNMAPPED, dtype=np.int32)
+        lut[kept] = np.arange(len(kept), dtype=np.int32)
+        return lut
+
+    # --- Name helpers (the dict shapes the scripts have always used) ---
+
+    def master_id_to_name(self):
+        return dict(enumerate(self.master_names))
+
+    def final_id_to_name(self):
+        return dict(enumerate(self.final_names))
+
+
+def remap(class_ids, lut):
+    """
+    Remaps an integer array of class ids through `lut` in one fancy-indexing step.
+    Returns (new_ids, keep_mask); ids outside the table or mapped to UNMAPPED have keep_mask False.
+    """
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    in_range = (class_ids >= 0) & (class_ids < len(lut))
+    new_ids = np.full(class_ids.shape, UNMAPPED, dtype=np.int32)
+    new_ids[in_range] = lut[class_ids[in_range]]
+    return new_ids, new_ids != UNMAPPED
+
+
+@lru_cache(maxsize=None)
+def load_taxonomy(path=TAXONOMY_PATH):
+    """Loads and validates taxonomy.yaml (cached, so every script in a process shares one instance)."""
+    with open(path, 'r') as f:
+        data = yaml.safe_load(f)
+    return Taxonomy(data['master'], data['final'], data['sources'])
+
+
+if __name__ == "__main__":
+    taxonomy = load_taxonomy()
+    print(f"✅ Taxonomy valid: {len(taxonomy.master_names)} master classes, {len(taxonomy.final_names)} final classes")
+    for ds_name, table in taxonomy.sources.items():
+        targets = len(set(table.values()))
+        print(f"   {ds_name}: {len(table)} source ids -> {targets} master classes")
@@ -0,0 +1,100 @@
+import math
+import cv2
+import torch
+import torchvision
+from ultralytics.engine.results import Results
+
+# --- Configuration ---
+# Sliced inference for high-resolution photos: the image is cut into overlapping TILE_SIZE tiles that run at
+# full resolution in one batch, so small items (garlic, chili, blueberries) are not lost to a single 640 downscale
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2  # Fraction of a tile shared with its neighbour; objects up to this size appear whole in some tile
+# Cost bound: larger images are downscaled until their grid fits. 6 tiles take a 4000x3000 photo to 1396x1047
+# (3x2 tiles), about 2.2x the detail of a single 640 pass, for the CPU cost of one imgsz 1920 pass. Raise for more detail.
+MAX_TILES = 6
+INCLUDE_FULL_IMAGE = True  # Also run the whole image at TILE_SIZE, for objects too large to fit in one tile
+EDGE_MARGIN = 2  # px; tile boxes touching an inner tile edge are cut objects, the neighbouring tile has them whole
+NMS_IOU = 0.5  # Class-aware NMS across tiles and the full-image pass
+
+
+def tile_starts(length, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Evenly spaced tile offsets covering [0, length) with at least `overlap` between neighbours."""
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - tile_size) / (tile_size * (1 - overlap))) + 1
+    step = (length - tile_size) / (count - 1)
+    return [round(i * step) for i in range(count)]
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """
+    Returns (scale, [(x0, y0, x1, y1)]) with the tiles in the scaled image. The scale is the largest
+    (<= 1, in 10% steps) at which the grid has at most max_tiles tiles.
+    """
+    scale = 1.0
+    while True:
+        scaled_w, scaled_h = max(1, round(width * scale)), max(1, round(height * scale))
+        xs, ys = tile_starts(scaled_w, tile_size, overlap), tile_starts(scaled_h, tile_size, overlap)
+        if len(xs) * len(ys) <= max_tiles or max(scaled_w, scaled_h) <= tile_size:
+            break
+        scale *= 0.9
+    tiles = [(x, y, min(x + tile_size, scaled_w), min(y + tile_size, scaled_h)) for y in ys for x in xs]
+    return scale, tiles
+
+
+def _interior_edge_mask(boxes, tile, width, height, margin=EDGE_MARGIN):
+    """True for boxes (tile coordinates) touching an edge of the tile that is not the image border."""
+    x0, y0, x1, y1 = tile
+    tile_w, tile_h = x1 - x0, y1 - y0
+    touches = torch.zeros(len(boxes), dtype=torch.bool)
+    if x0 > 0:
+        touches |= boxes[:, 0] <= margin
+    if y0 > 0:
+        touches |= boxes[:, 1] <= margin
+    if x1 < width:
+        touches |= boxes[:, 2] >= tile_w - margin
+    if y1 < height:
+        touches |= boxes[:, 3] >= tile_h - margin
+    return touches
+
+
+def predict_tiled(model, image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES,
+                  include_full_image=INCLUDE_FULL_IMAGE, nms_iou=NMS_IOU, path=None, **predict_args):
+    """
+    Runs `model` on the tiles of one BGR image as a single batch (plus the full image) and merges the boxes
+    with class-aware NMS. Returns an Ultralytics Results in original image coordinates, so
+    summarize_results()/result_record() work unchanged. Cost: at most max_tiles (+1) tile_size forward passes.
+    An `imgsz` predict argument is taken as the tile size.
+    """
+    tile_size = predict_args.pop('imgsz', tile_size)
+    height, width = image.shape[:2]
+    scale, tiles = tile_grid(width, height, tile_size, overlap, max_tiles)
+    scaled = image if scale == 1.0 else cv2.resize(image, (round(width * scale), round(height * scale)),
+                                                   interpolation=cv2.INTER_AREA)
+    scaled_h, scaled_w = scaled.shape[:2]
+
+    # 1. One batch: every tile, then the whole image
+    batch = [scaled[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+    if include_full_image and len(tiles) > 1:
+        batch.append(image)
+    predict_args = {**predict_args, 'imgsz': tile_size, 'verbose': False}
+    results = model.predict(batch, **predict_args)
+
+    # 2. Tile boxes back to original image coordinates, dropping the ones cut by an inner seam
+    detections = []
+    for tile, result in zip(tiles, results):
+        data = result.boxes.data.cpu()  # (N, 6): x1, y1, x2, y2, conf, cls
+        data = data[~_interior_edge_mask(data[:, :4], tile, scaled_w, scaled_h)]
+        offset = torch.tensor([tile[0], tile[1], tile[0], tile[1]], dtype=data.dtype)
+        data[:, :4] = (data[:, :4] + offset) / scale
+        detections.append(data)
+    if len(results) > len(tiles):
+        detections.append(results[-1].boxes.data.cpu())
+
+    # 3. Class-aware NMS across tiles (overlap duplicates) and the full-image pass
+    merged = torch.cat(detections) if detections else torch.zeros((0, 6))
+    keep = torchvision.ops.batched_nms(merged[:, :4], merged[:, 4], merged[:, 5].long(), nms_iou)
+    merged = merged[keep[:predict_args.get('max_det', 300)]]
+    merged[:, [0, 2]] = merged[:, [0, 2]].clamp(0, width)
+    merged[:, [1, 3]] = merged[:, [1, 3]].clamp(0, height)
+    return Results(orig_img=image, path=str(path or ''), names=model.names, boxes=merged)
@@ -4,8 +4,18 @@ import os
 # --- MODEL CONFIGURATION ---
 
 # Path to the custom dataset YAML file (must be in the project root)
+# To train on a balancing variant built by views.py, point this at e.g. 'dataset_views/min30_max300/data.yaml'
 DATA_YAML_PATH = 'oid_ingredients.yaml'
 
+# Optional: data.yaml of a dataset packed with packed_dataset.py (e.g. 'packed_dataset/data.yaml').
+# When set, training reads a few large shard files instead of one image + one label file per sample,
+# which is much faster on network drives (Google Drive, NFS). Leave as None to train on DATA_YAML_PATH.
+PACKED_DATA_YAML = None
+
+# Optional: read images from the pre-resized uint8 cache built by letterbox_cache.py (built on first use,
+# rebuilt automatically when images or imgsz change). Removes JPEG decoding and resizing from every epoch.
+USE_LETTERBOX_CACHE = False
+
 # Path to the pre-trained model weights for transfer learning
 MODEL_WEIGHTS = 'yolov8n.pt' 
 
@@ -31,8 +41,15 @@ def start_training():
     # 1. Load the model (weights file will download if not found)
     model = YOLO(TRAINING_ARGS['model'])
 
-    # 2. Start training
-    results = model.train(**TRAINING_ARGS)
+    # 2. Start training (packed datasets need the trainer that knows how to read shards)
+    if PACKED_DATA_YAML:
+        from packed_loader import PackedDetectionTrainer
+        results = model.train(**{**TRAINING_ARGS, 'data': PACKED_DATA_YAML}, trainer=PackedDetectionTrainer)
+    elif USE_LETTERBOX_CACHE:
+        from letterbox_cache import LetterboxCacheTrainer
+        results = model.train(**TRAINING_ARGS, trainer=LetterboxCacheTrainer)
+    else:
+        results = model.train(**TRAINING_ARGS)
     
     # 3. Report completion
     output_dir = os.path.join(TRAINING_ARGS['project'], TRAINING_ARGS['name'])
@@ -0,0 +1,285 @@
+import os
+import json
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dataset_stats import load_split_arrays
+from file_catalog import ImageCatalog
+from materialize import Materializer, write_text_if_changed
+from taxonomy import load_taxonomy
+
+# --- Configuration ---
+# Point this to the dataset to check; every split's labels are parsed into one array and checked in bulk
+DATASET_ROOT = Path('FinalDataset')
+SPLITS = ['train', 'val', 'test']
+WORKERS = None  # Number of parser processes (None = one per CPU core)
+NUM_CLASSES = len(load_taxonomy().final_names)
+
+# Geometry thresholds (normalized coordinates)
+MIN_BOX_SIDE = 1e-4  # Boxes thinner than this after clipping are dropped as zero-area
+MIN_KEPT_FRACTION = 0.5  # A box clipped to [0, 1] is kept only if at least half of its area was inside the image
+NEAR_DUPLICATE_IOU = 0.9  # Same class + IoU above this in the same image = the same object labeled twice
+DUPLICATE_DECIMALS = 6  # Exact duplicates are compared at this precision
+CLIP_TOLERANCE = 1e-6  # Rounding overshoot (e.g. 1.0000001) is not worth rewriting a file for
+
+REPORT_PATH = Path('label_validation_report.json')
+REPAIR_LINK_MODE = 'hardlink'  # How images (and untouched label files) are placed in the repaired copy
+EXAMPLES_PER_ISSUE = 20  # File names listed per issue in the report
+
+# Issue codes, in the order they are checked. Every flagged box is dropped, except 'clipped' (repaired in place).
+ISSUES = ['bad_class', 'non_finite', 'outside_image', 'clipped', 'zero_area', 'exact_duplicate', 'near_duplicate']
+
+
+# ====================================================================
+# 1. VECTORIZED CHECKS (one split at a time, all boxes at once)
+# ====================================================================
+
+def _xywh_to_xyxy(boxes):
+    half = boxes[:, 2:4] / 2
+    return np.concatenate([boxes[:, 0:2] - half, boxes[:, 0:2] + half], axis=1)
+
+
+def _xyxy_to_xywh(boxes):
+    size = boxes[:, 2:4] - boxes[:, 0:2]
+    return np.concatenate([boxes[:, 0:2] + size / 2, size], axis=1)
+
+
+def _pairs_within_groups(group_sizes):
+    """All (i, j) index pairs with i < j inside each consecutive group of a sorted array, without a Python loop."""
+    starts = np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+    position = np.arange(len(starts)) - starts
+    partners = np.repeat(group_sizes, group_sizes) - 1 - position  # Later elements of the same group
+    first = np.repeat(np.arange(len(starts)), partners)
+    offset = np.arange(len(first)) - np.repeat(np.cumsum(partners) - partners, partners)
+    return first, first + 1 + offset
+
+
+def find_duplicates(class_ids, boxes_xyxy, file_index, iou_threshold=NEAR_DUPLICATE_IOU):
+    """
+    Returns (exact, near) boolean masks. A box is a duplicate if an EARLIER box of the same class in the same
+    image is identical (exact) or overlaps it by at least iou_threshold (near); the first occurrence is kept.
+    """
+    n = len(class_ids)
+    exact = np.zeros(n, dtype=bool)
+    near = np.zeros(n, dtype=bool)
+    if n == 0:
+        return exact, near
+
+    # Exact: identical rounded rows within one file
+    key = np.column_stack([file_index, class_ids, np.round(boxes_xyxy, DUPLICATE_DECIMALS)])
+    _, first_seen = np.unique(key, axis=0, return_index=True)
+    exact[:] = True
+    exact[first_seen] = False
+
+    # Near: pairwise IoU inside every (file, class) group
+    order = np.lexsort((np.arange(n), class_ids, file_index))
+    group_key = file_index[order].astype(np.int64) * (class_ids.max() + 1) + class_ids[order]
+    _, group_sizes = np.unique(group_key, return_counts=True)  # group_key is sorted, so groups are contiguous
+    i, j = _pairs_within_groups(group_sizes)
+    i, j = order[i], order[j]
+    candidates = ~exact[i] & ~exact[j]
+    i, j = i[candidates], j[candidates]
+
+    a, b = boxes_xyxy[i], boxes_xyxy[j]
+    inter_w = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (area_a + area_b - inter)
+    duplicate_pairs = iou >= iou_threshold
+    near[np.maximum(i, j)[duplicate_pairs]] = True  # The later box of the pair is the copy
+    return exact, near
+
+
+def check_labels(labels, file_index, num_classes=NUM_CLASSES):
+    """
+    Runs every check on one split's [N, 5] label array.
+    Returns (issues {code: bool mask}, keep mask, repaired [N, 5] rows).
+    """
+    labels = labels.astype(np.float64)
+    class_values = labels[:, 0]
+    class_ids = class_values.astype(np.int64)
+    issues = {}
+
+    issues['bad_class'] = (class_values != class_ids) | (class_ids < 0) | (class_ids >= num_classes)
+    issues['non_finite'] = ~np.isfinite(labels).all(axis=1) & ~issues['bad_class']
+    dropped = issues['bad_class'] | issues['non_finite']
+
+    # Boxes reaching outside the image are clipped; if most of the box was outside it is dropped instead.
+    # (Ultralytics rejects the WHOLE image when any coordinate is above 1, so one bad box costs all its neighbors.)
+    boxes = np.where(dropped[:, None], 0.0, labels[:, 1:5])
+    xyxy = _xywh_to_xyxy(boxes)
+    clipped_xyxy = np.clip(xyxy, 0.0, 1.0)
+    area = np.prod(xyxy[:, 2:4] - xyxy[:, 0:2], axis=1)
+    clipped_area = np.prod(np.clip(clipped_xyxy[:, 2:4] - clipped_xyxy[:, 0:2], 0, None), axis=1)
+    was_clipped = (np.abs(xyxy - clipped_xyxy) > CLIP_TOLERANCE).any(axis=1) & ~dropped
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inside_fraction = np.where(area > 0, clipped_area / area, 0.0)
+    issues['outside_image'] = was_clipped & (inside_fraction < MIN_KEPT_FRACTION)
+    issues['clipped'] = was_clipped & ~issues['outside_image']
+    dropped |= issues['outside_image']
+
+    sides = clipped_xyxy[:, 2:4] - clipped_xyxy[:, 0:2]
+    issues['zero_area'] = (sides < MIN_BOX_SIDE).any(axis=1) & ~dropped
+    dropped |= issues['zero_area']
+
+    # Duplicates are only searched among the boxes that survived the geometry checks
+    survivors = np.flatnonzero(~dropped)
+    exact, near = find_duplicates(class_ids[survivors], clipped_xyxy[survivors], file_index[survivors])
+    issues['exact_duplicate'] = np.zeros(len(labels), dtype=bool)
+    issues['near_duplicate'] = np.zeros(len(labels), dtype=bool)
+    issues['exact_duplicate'][survivors[exact]] = True
+    issues['near_duplicate'][survivors[near]] = True
+    dropped |= issues['exact_duplicate'] | issues['near_duplicate']
+
+    repaired = labels.copy()
+    repaired[:, 1:5] = np.where(issues['clipped'][:, None], _xyxy_to_xywh(clipped_xyxy), labels[:, 1:5])
+    return issues, ~dropped, repaired
+
+
+# ====================================================================
+# 2. REPORT AND REPAIR
+# ====================================================================
+
+def validate_dataset(dataset_root=DATASET_ROOT, splits=SPLITS, num_classes=NUM_CLASSES, workers=None):
+    """Parses and checks every split with one shared process pool. Returns {split: result dict}."""
+    dataset_root = Path(dataset_root)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for split in splits:
+            labels_dir = dataset_root / split / 'labels'
+            if not labels_dir.exists():
+                continue
+            label_files, labels, file_index, objects_per_file, malformed = load_split_arrays(labels_dir, executor=pool, strict=True)
+            issues, keep, repaired = check_labels(labels, file_index, num_classes)
+            results[split] = {
+                'label_files': label_files, 'labels': repaired, 'file_index': file_index, 'keep': keep,
+                'objects_per_file': objects_per_file, 'issues': issues, 'malformed_lines': malformed,
+            }
+    return results
+
+
+def summarize(results):
+    """JSON-ready summary: counts per issue and example files, per split."""
+    summary = {}
+    for split, result in results.items():
+        label_files, file_index = result['label_files'], result['file_index']
+        split_summary = {
+            'files': len(label_files),
+            'boxes': int(len(result['keep'])),
+            'boxes_dropped': int((~result['keep']).sum()),
+            'malformed_lines': result['malformed_lines'],
+            'issues': {},
+        }
+        for code in ISSUES:
+            mask = result['issues'][code]
+            affected = np.unique(file_index[mask])
+            split_summary['issues'][code] = {
+                'boxes': int(mask.sum()),
+                'files': int(len(affected)),
+                'examples': [Path(label_files[i]).name for i in affected[:EXAMPLES_PER_ISSUE]],
+            }
+        summary[split] = split_summary
+    return summary
+
+
+def print_report(summary):
+    for split, split_summary in summary.items():
+        print(f"\n--- {split.upper()}: {split_summary['files']} label files, {split_summary['boxes']} boxes ---")
+        for code in ISSUES:
+            issue = split_summary['issues'][code]
+            if issue['boxes']:
+                action = 'repaired' if code == 'clipped' else 'dropped'
+                print(f"⚠️  {code:<16} {issue['boxes']:>7} boxes in {issue['files']:>6} files ({action}), "
+                      f"e.g. {', '.join(issue['examples'][:3])}")
+        if split_summary['malformed_lines']:
+            print(f"⚠️  {'malformed_line':<16} {split_summary['malformed_lines']:>7} lines (dropped)")
+        if not split_summary['boxes_dropped'] and not split_summary['issues']['clipped']['boxes'] \
+                and not split_summary['malformed_lines']:
+            print("✅ No problems found")
+
+
+def _has_malformed_lines(label_file, parsed_rows):
+    """True if the file has non-blank lines the parser skipped (they disappear from the repaired copy)."""
+    with open(label_file, 'rb') as f:
+        return sum(1 for line in f if line.strip()) != parsed_rows
+
+
+def write_repaired_dataset(results, source_root, output_root, link_mode=REPAIR_LINK_MODE):
+    """
+    Writes a repaired copy of the dataset to output_root: files with problems get rewritten labels,
+    every other label file and every image is linked, so the copy costs almost no disk space.
+    """
+    source_root, output_root = Path(source_root), Path(output_root)
+    rewritten = 0
+    with Materializer(link_mode, incremental=True) as materializer:
+        for split, result in results.items():
+            label_files, file_index = result['label_files'], result['file_index']
+            labels, keep, objects_per_file = result['labels'], result['keep'], result['objects_per_file']
+            touched = result['issues']['clipped'] | ~keep
+            touched_files = np.zeros(len(label_files), dtype=bool)
+            touched_files[file_index[touched]] = True
+            boundaries = np.concatenate([[0], np.cumsum(objects_per_file)])
+
+            labels_out = output_root / split / 'labels'
+            images_out = output_root / split / 'images'
+            labels_out.mkdir(parents=True, exist_ok=True)
+            images_out.mkdir(parents=True, exist_ok=True)
+
+            for i, label_file in enumerate(label_files):
+                target = labels_out / os.path.basename(label_file)
+                if touched_files[i] or (result['malformed_lines'] and _has_malformed_lines(label_file, objects_per_file[i])):
+                    rows = labels[boundaries[i]:boundaries[i + 1]][keep[boundaries[i]:boundaries[i + 1]]]
+                    text = ''.join(f"{int(row[0])} {row[1]:.6f} {row[2]:.6f} {row[3]:.6f} {row[4]:.6f}\n" for row in rows)
+                    rewritten += write_text_if_changed(target, text)
+                else:
+                    materializer.submit(label_file, target)
+
+            image_catalog = ImageCatalog(source_root / split / 'images')
+            for stem in image_catalog.stems():
+                image = image_catalog.get(stem)
+                materializer.submit(image, images_out / image.name)
+            materializer.flush()
+
+    print(f"\n✅ Repaired dataset written to {output_root}: {rewritten} label files rewritten")
+    print(f"   Links: {materializer.report()}")
+    verify_repaired_labels(output_root, list(results))
+
+
+def verify_repaired_labels(output_root, splits):
+    """Re-parses the repaired labels strictly: every non-blank line must be exactly 5 numeric tokens."""
+    malformed = {}
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        for split in splits:
+            malformed[split] = load_split_arrays(Path(output_root) / split / 'labels', executor=pool, strict=True)[4]
+    if any(malformed.values()):
+        raise RuntimeError(f"Repaired labels still contain malformed lines: {malformed}")
+    print("✅ Every repaired label line has exactly 5 tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check YOLO label geometry in bulk and optionally write a repaired copy.")
+    parser.add_argument('dataset_root', type=Path, nargs='?', default=DATASET_ROOT)
+    parser.add_argument('--splits', nargs='+', default=SPLITS)
+    parser.add_argument('--nc', type=int, default=NUM_CLASSES, help="Number of classes (default: taxonomy 'final' list)")
+    parser.add_argument('--report', type=Path, default=REPORT_PATH)
+    parser.add_argument('--repair-to', type=Path, help="Write a repaired copy of the dataset here (the source is not modified)")
+    args = parser.parse_args()
+
+    print(f"--- Validating labels in: {args.dataset_root} (nc: {args.nc}) ---")
+    results = validate_dataset(args.dataset_root, args.splits, args.nc, WORKERS)
+    summary = summarize(results)
+    print_report(summary)
+    with open(args.report, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"\nReport saved to {args.report}")
+
+    if args.repair_to:
+        write_repaired_dataset(results, args.dataset_root, args.repair_to)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+import argparse
+from pathlib import Path
+from tqdm import tqdm
+import discard
+from annotation_index import load_annotation_index, class_counts, load_exclusions, drop_stems
+from file_catalog import ImageCatalog
+from materialize import Materializer, write_text_if_changed
+
+# ====================================================================
+# 1. CONFIGURATION
+# ====================================================================
+
+# Views are built from the merged (master id) dataset and never modify it
+SOURCE_ROOT = discard.SOURCE_ROOT
+VIEWS_ROOT = Path('./dataset_views')
+SPLITS = ['train', 'val', 'test']
+
+# Ultralytics finds a label by replacing /images/ with /labels/ in the image path, so a view with its own
+# (remapped) labels needs its own images/ entries. They are links: no image data is duplicated.
+# 'symlink' needs Developer Mode or admin rights on Windows; 'hardlink' needs the view on the same drive.
+VIEW_LINK_MODE = 'hardlink'
+
+
+# ====================================================================
+# 2. VIEW GENERATION
+# ====================================================================
+
+def write_file_list(list_path, image_names, split):
+    """Writes an Ultralytics image list; './' entries are resolved relative to the list file."""
+    lines = [f"./{split}/images/{name}\n" for name in sorted(image_names)]
+    return write_text_if_changed(list_path, ''.join(lines))
+
+
+def build_view(name, min_samples=discard.MIN_SAMPLES, max_samples=discard.MAX_SAMPLES,
+               source_root=SOURCE_ROOT, views_root=VIEWS_ROOT):
+    """
+    Builds (or incrementally refreshes) the balancing variant `name` under views_root/name:
+    per-split image lists, remapped label overlays, linked image entries and a data.yaml.
+    Returns the path of the view's data.yaml.
+    """
+    view_root = views_root / name
+    print(f"--- Building view '{name}' (Min: {min_samples}, Max: {max_samples}) from {source_root} ---")
+
+    # 1. Same selection as discard.py, counted from the data instead of the SAMPLE_COUNTS snapshot
+    # Excluded images (image_dedup.py duplicates, image_integrity.py corrupt files) are left out before counting
+    annotations = drop_stems(load_annotation_index(source_root, splits=SPLITS), load_exclusions(source_root))
+    class_to_stems, _ = discard.build_inverted_index(annotations)
+    counts = class_counts(annotations)
+    sample_counts = {master_id: counts.get(master_id, 0) for master_id in sorted(discard.MASTER_ID_TO_NAME)}
+    kept_master_indices, images_to_keep = discard.select_images_to_keep(
+        class_to_stems, sample_counts, min_samples, max_samples)
+
+    sorted_kept_indices = sorted(kept_master_indices)
+    old_to_new_lut = discard.TAXONOMY.subset_lut(sorted_kept_indices)
+
+    # 2. Label overlays + linked image entries + file lists, split by split
+    totals = {}
+    labels_written = 0
+    stale_removed = 0
+    with Materializer(VIEW_LINK_MODE, incremental=True) as materializer:
+        for split in SPLITS:
+            source_labels_dir = source_root / split / 'labels'
+            if not source_labels_dir.exists():
+                continue
+            (view_root / split / 'images').mkdir(parents=True, exist_ok=True)
+            (view_root / split / 'labels').mkdir(parents=True, exist_ok=True)
+
+            image_catalog = ImageCatalog(source_root / split / 'images')
+            written_stems = set()
+            image_names = []
+
+            for label_name in tqdm(os.listdir(source_labels_dir), desc=f"View {name}/{split}"):
+                stem = Path(label_name).stem
+                source_image = image_catalog.get(stem)
+                if stem not in images_to_keep or source_image is None:
+                    continue
+
+                new_annotations = discard.remap_label_lines(source_labels_dir / label_name, old_to_new_lut)
+                labels_written += write_text_if_changed(view_root / split / 'labels' / f"{stem}.txt",
+                                                        discard.format_label_text(new_annotations))
+                materializer.submit(source_image, view_root / split / 'images' / source_image.name)
+                written_stems.add(stem)
+                image_names.append(source_image.name)
+
+            materializer.flush()
+            stale_removed += discard.remove_stale_outputs(view_root / split, written_stems)
+            write_file_list(view_root / f"{split}.txt", image_names, split)
+            totals[split] = len(image_names)
+
+    # 3. data.yaml pointing at the lists (train.py only needs DATA_YAML_PATH changed to switch variants)
+    final_names_list = {new_id: discard.MASTER_ID_TO_NAME[old_id] for new_id, old_id in enumerate(sorted_kept_indices)}
+    yaml_content = f"""
+# Dataset view '{name}' (nc: {len(sorted_kept_indices)}, Min: {min_samples}, Max: {max_samples}).
+# Generated by views.py from {source_root.name}; the source dataset is not modified.
+
+path: {view_root.resolve().as_posix()}
+"""
+    for split in SPLITS:
+        if split in totals:
+            yaml_content += f"{split}: {split}.txt\n"
+    yaml_content += f"\nnc: {len(sorted_kept_indices)}\n\nnames:\n"
+    for index in sorted(final_names_list.keys()):
+        yaml_content += f"  {index}: {final_names_list[index]}\n"
+
+    yaml_path = view_root / 'data.yaml'
+    write_text_if_changed(yaml_path, yaml_content)
+
+    print(f"\n✅ View '{name}' ready: {yaml_path}")
+    print(f"   Images: {', '.join(f'{split} {count}' for split, count in totals.items())} (Classes Kept: {len(sorted_kept_indices)})")
+    print(f"   Labels: {labels_written} written, {stale_removed} stale files removed")
+    print(f"   Links: {materializer.report()}")
+    return yaml_path
+
+
+def list_views(views_root=VIEWS_ROOT):
+    """Returns the names of every view that has a data.yaml."""
+    if not views_root.exists():
+        return []
+    return sorted(path.parent.name for path in views_root.glob('*/data.yaml'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build balancing variants as file-list views of the merged dataset.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Create or refresh a view")
+    build.add_argument('name', help="View name, e.g. min30_max300")
+    build.add_argument('--min', type=int, default=discard.MIN_SAMPLES, dest='min_samples')
+    build.add_argument('--max', type=int, default=discard.MAX_SAMPLES, dest='max_samples')
+    build.add_argument('--source', type=Path, default=SOURCE_ROOT)
+
+    subparsers.add_parser('list', help="List existing views")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_view(args.name, args.min_samples, args.max_samples, args.source)
+    else:
+        for view_name in list_views():
+            print(f"{view_name:<30} {VIEWS_ROOT / view_name / 'data.yaml'}")
+
+
+if __name__ == "__main__":
+    main()